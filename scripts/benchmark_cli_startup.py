@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+"""
+script: benchmark_cli_startup
+measures the wall time of noresm-regrid invocations that should return quickly
+(--help, and optionally a regrid run where every output already exists), and
+lists the heavy modules that are imported when the command line is parsed
+"""
+
+#++++++++++++++++++++++++++++++
+# Import python modules
+#++++++++++++++++++++++++++++++
+
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+# Determine local directory path:
+_LOCAL_PATH = os.path.dirname(os.path.abspath(__file__))
+_SRC_PATH = os.path.abspath(os.path.join(_LOCAL_PATH, "../", "src"))
+
+# Modules that take a large part of a second or more to import
+HEAVY_MODULES = [
+    "xarray", "scipy", "xesmf", "ESMF", "esmpy", "dask", "distributed",
+    "zarr", "numcodecs", "matplotlib", "cartopy", "gents", "netCDF4",
+]
+
+#++++++++++++++++++++++++++++++
+# Input argument parser function
+#++++++++++++++++++++++++++++++
+
+def parse_arguments():
+
+    """
+    Parses command-line input arguments using the argparse
+    python module and outputs the final argument object.
+    """
+
+    #Create parser object:
+    parser = argparse.ArgumentParser(description='Benchmark the startup time of the noresm-regrid command line')
+
+    parser.add_argument('--repeats', type=int, default=5,
+                        help="Number of times each command is run (default: 5)")
+
+    parser.add_argument('--regrid-args', type=str,
+                        help="Arguments of a regrid run to time, e.g. "
+                        "\"--realm atm --inputres ne30 --inputdir DIR --outputdir DIR\" for a "
+                        "folder that is already regridded (optional)")
+
+    # Parse Argument inputs
+    args = parser.parse_args()
+
+    # Error checks
+    return args
+
+#++++++++++++++++++++++++++++++
+# Timing functions
+#++++++++++++++++++++++++++++++
+
+def get_environment():
+
+    """
+    Returns the environment for running the package from this checkout.
+    """
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [_SRC_PATH, env.get("PYTHONPATH")]))
+    return env
+
+def time_command(cli_args, repeats):
+
+    """
+    Returns the wall times of running noresm-regrid with cli_args.
+    """
+
+    command = [sys.executable, "-m", "noresm_pyregridding"] + cli_args
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(command, env=get_environment(), stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+def get_imported_heavy_modules():
+
+    """
+    Returns the heavy modules imported by building the parser of every subcommand.
+    """
+
+    code = (
+        "import sys\n"
+        "from noresm_pyregridding import cli\n"
+        "cli.build_parser()\n"
+        f"print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], env=get_environment(),
+                            capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+#++++++++++++++++++++++++++++++
+# main benchmark script
+#++++++++++++++++++++++++++++++
+
+def main():
+
+    # Parse command-line arguments
+    args = parse_arguments()
+
+    commands = {
+        "python startup": None,
+        "--help": ["--help"],
+        "regrid --help": ["regrid", "--help"],
+        "timeseries --help": ["timeseries", "--help"],
+        "evaluate --help": ["evaluate", "--help"],
+    }
+    if args.regrid_args:
+        commands["regrid (no-op)"] = ["regrid"] + args.regrid_args.split()
+
+    print(f"{'command':>20} {'median [s]':>11} {'min [s]':>8}")
+    for name, cli_args in commands.items():
+        if cli_args is None:
+            # baseline of starting the interpreter itself
+            times = []
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                subprocess.run([sys.executable, "-c", "pass"], check=True)
+                times.append(time.perf_counter() - start)
+        else:
+            times = time_command(cli_args, args.repeats)
+        print(f"{name:>20} {statistics.median(times):>11.3f} {min(times):>8.3f}")
+
+    heavy = get_imported_heavy_modules()
+    print(f"Heavy modules imported at startup: {' '.join(heavy) if heavy else 'none'}")
+
+if __name__ == "__main__":
+    main()
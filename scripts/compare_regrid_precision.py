@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+"""
+script: compare_regrid_precision
+regrids one cam or clm output file in each supported precision mode and reports
+the error of the conservative global integrals relative to the float64 reference
+"""
+
+#++++++++++++++++++++++++++++++
+# Import python modules
+#++++++++++++++++++++++++++++++
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import xarray as xr
+
+# Determine local directory path:
+_LOCAL_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# Append path to regridding utilities
+sys.path.append(os.path.join(_LOCAL_PATH, "../", "src"))
+
+# Now import regridding utilities
+from noresm_pyregridding import noresm_pyregridding
+
+#++++++++++++++++++++++++++++++
+# Input argument parser function
+#++++++++++++++++++++++++++++++
+
+def parse_arguments():
+
+    """
+    Parses command-line input arguments using the argparse
+    python module and outputs the final argument object.
+    """
+
+    #Create parser object:
+    parser = argparse.ArgumentParser(description='Compare regridding precision modes against the float64 reference')
+
+    parser.add_argument("--realm",
+                        choices=["atm","lnd"],
+                        help="Realm of the input file (required)",
+                        required=True,)
+
+    parser.add_argument('--inputfile', type=str,
+                        help="Full pathname of an input spectral element data file (required)",
+                        required=True)
+
+    parser.add_argument('--weightfile', type=str,
+                        help="Full pathname of the ESMF weight file to regrid with (required)",
+                        required=True)
+
+    parser.add_argument('--variables', type=str,
+                        help="Comma separated list of variables to compare (default: all regridded variables)")
+
+    # Parse Argument inputs
+    args = parser.parse_args()
+
+    # Error checks
+    return args
+
+#++++++++++++++++++++++++++++++
+# Comparison functions
+#++++++++++++++++++++++++++++++
+
+def global_integrals(ds, area, variables):
+
+    """
+    Returns the area weighted global integral of each variable, for every
+    remaining (time, level, ...) index, computed in float64.
+    """
+
+    integrals = {}
+    for var in variables:
+        field = ds[var].astype(np.float64)
+        integrals[var] = (field * area).sum(["lat", "lon"], skipna=True).values
+    return integrals
+
+def regrid_with_precision(args, data_in, precision):
+
+    """
+    Regrids the input data with the given precision and returns the regridded
+    dataset and the wall time of the regridding itself.
+    """
+
+    regridder = noresm_pyregridding.make_se_regridder(
+        weight_file=args.weightfile, precision=precision
+    )
+    start = time.perf_counter()
+    if args.realm == 'atm':
+        data_regridded = noresm_pyregridding.regrid_cam_se_data(regridder, data_in, False, precision=precision)
+    else:
+        data_regridded = noresm_pyregridding.regrid_ctsm_se_data(regridder, data_in, False, precision=precision)
+    return data_regridded, time.perf_counter() - start
+
+#++++++++++++++++++++++++++++++
+# main comparison script
+#++++++++++++++++++++++++++++++
+
+def main():
+
+    # Parse command-line arguments
+    args = parse_arguments()
+
+    # Read all data up front so that only the regridding is timed
+    data_in = xr.open_dataset(args.inputfile).load()
+    area = noresm_pyregridding.make_target_cell_areas(args.weightfile)
+
+    results = {}
+    for precision in noresm_pyregridding.PRECISIONS:
+        results[precision] = regrid_with_precision(args, data_in, precision)
+
+    reference, reference_time = results["float64"]
+    if args.variables:
+        variables = args.variables.split(",")
+    else:
+        variables = [
+            var for var in reference.data_vars
+            if "lat" in reference[var].dims and "lon" in reference[var].dims
+        ]
+    reference_integrals = global_integrals(reference, area, variables)
+
+    print(f"{'precision':>10} {'time [s]':>10} {'speedup':>8} {'output MB':>10} "
+          f"{'max rel. err. integral':>24} {'worst variable':>20}")
+    for precision, (data_regridded, regrid_time) in results.items():
+        integrals = global_integrals(data_regridded, area, variables)
+        worst_var = None
+        worst_err = 0.0
+        for var in variables:
+            scale = np.abs(reference_integrals[var])
+            with np.errstate(divide="ignore", invalid="ignore"):
+                err = np.abs(integrals[var] - reference_integrals[var]) / scale
+            err = np.nanmax(np.where(scale > 0, err, 0.0)) if err.size else 0.0
+            if err >= worst_err:
+                worst_err = err
+                worst_var = var
+        size_mb = sum(data_regridded[var].nbytes for var in variables) / 1e6
+        print(f"{precision:>10} {regrid_time:>10.3f} {reference_time / regrid_time:>8.2f} "
+              f"{size_mb:>10.1f} {worst_err:>24.3e} {str(worst_var):>20}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+"""
+script: synthetic_history_writer
+writes synthetic cam or clm history files the way a running model does, appending
+one time step at a time, to try out the --watch mode of regrid_all_files_in_folder.py
+"""
+
+#++++++++++++++++++++++++++++++
+# Import python modules
+#++++++++++++++++++++++++++++++
+
+import os
+import time
+import argparse
+import netCDF4
+import numpy as np
+
+#++++++++++++++++++++++++++++++
+# Input argument parser function
+#++++++++++++++++++++++++++++++
+
+def parse_arguments():
+
+    """
+    Parses command-line input arguments using the argparse
+    python module and outputs the final argument object.
+    """
+
+    #Create parser object:
+    parser = argparse.ArgumentParser(description='Write synthetic spectral element history files over time')
+
+    parser.add_argument("--realm",
+                        choices=["atm","lnd"],
+                        help="Realm of the history files to write (required)",
+                        required=True,)
+
+    parser.add_argument('--outputdir', type=str,
+                        help="Full path to directory where the history files are written (required)",
+                        required=True)
+
+    parser.add_argument('--ncol', type=int,
+                        help="Number of spectral element columns, must match the weight file used for "
+                        "regridding (required, e.g. 21600 for ne30pg3)",
+                        required=True)
+
+    parser.add_argument('--case', type=str, default="synthetic",
+                        help="Case name used in the file names (default: synthetic)")
+
+    parser.add_argument('--nfiles', type=int, default=3,
+                        help="Number of history files to write (default: 3)")
+
+    parser.add_argument('--steps-per-file', type=int, default=4,
+                        help="Number of time steps in each history file (default: 4)")
+
+    parser.add_argument('--step-interval', type=float, default=5.0,
+                        help="Seconds between writing time steps (default: 5)")
+
+    # Parse Argument inputs
+    args = parser.parse_args()
+
+    # Error checks
+    return args
+
+#++++++++++++++++++++++++++++++
+# History file writing
+#++++++++++++++++++++++++++++++
+
+def create_history_file(filepath, realm, ncol):
+
+    """
+    Creates an empty history file with an unlimited time dimension.
+    """
+
+    dimname = "ncol" if realm == "atm" else "lndgrid"
+    nc = netCDF4.Dataset(filepath, "w")
+    nc.createDimension("time", None)
+    nc.createDimension(dimname, ncol)
+    time_var = nc.createVariable("time", "f8", ("time",))
+    time_var.units = "days since 0001-01-01 00:00:00"
+    time_var.calendar = "noleap"
+    field = nc.createVariable("TS", "f4", ("time", dimname))
+    field.units = "K"
+    if realm == "lnd":
+        landfrac = nc.createVariable("landfrac", "f4", (dimname,))
+        landfrac[:] = np.random.uniform(0.0, 1.0, ncol).astype(np.float32)
+    return nc
+
+def main():
+
+    # Parse command-line arguments
+    args = parse_arguments()
+
+    os.makedirs(args.outputdir, exist_ok=True)
+    stream = "cam.h1" if args.realm == "atm" else "clm2.h1"
+    day = 0
+    for nfile in range(args.nfiles):
+        filepath = os.path.join(
+            args.outputdir, f"{args.case}.{stream}.0001-01-{nfile + 1:02d}-00000.nc"
+        )
+        print(f"Writing {filepath}")
+        nc = create_history_file(filepath, args.realm, args.ncol)
+        for step in range(args.steps_per_file):
+            nc["time"][step] = day
+            nc["TS"][step, :] = 280.0 + 10.0 * np.random.standard_normal(args.ncol)
+            nc.sync()
+            day += 1
+            time.sleep(args.step_interval)
+        nc.close()
+    print("Finished writing synthetic history files")
+
+if __name__ == "__main__":
+    main()
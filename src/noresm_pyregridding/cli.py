@@ -0,0 +1,56 @@
+import argparse
+import logging
+import sys
+
+from . import evaluate, regrid_folder, timeseries
+
+# Subcommands of noresm-regrid: module adding the arguments and running the command
+COMMANDS = {
+    "regrid": (
+        regrid_folder,
+        "Regrid all cam or clm output files in a folder from the spectral element grid to lat/lon",
+    ),
+    "timeseries": (
+        timeseries,
+        "Create time series for all time slice files in a folder",
+    ),
+    "evaluate": (
+        evaluate,
+        "Compare model output with observations for a table of variables and write a summary table",
+    ),
+}
+
+
+def build_parser(prog=None):
+    """Return the argument parser of noresm-regrid and its subcommands"""
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="Regridding and time series tools for NorESM spectral element output",
+    )
+    subparsers = parser.add_subparsers(dest="command", metavar="command", required=True)
+    for name, (module, description) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=description, description=description)
+        module.add_arguments(subparser)
+        subparser.set_defaults(module=module, subparser=subparser)
+    return parser
+
+
+def setup_logging(debug):
+    logging.basicConfig(
+        level=logging.DEBUG if debug else logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+
+
+def main(argv=None, prog=None):
+    """Entry point of the noresm-regrid console script"""
+    args = build_parser(prog=prog).parse_args(argv)
+    if hasattr(args.module, "check_arguments"):
+        args.module.check_arguments(args.subparser, args)
+    setup_logging(args.debug)
+    args.module.run(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
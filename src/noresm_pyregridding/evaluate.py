@@ -0,0 +1,103 @@
+import logging
+import os
+
+# The evaluation engine imports xarray and the regridding helpers, it is only
+# imported once the command runs so that --help stays fast.
+
+logger = logging.getLogger("noresm_pyregridding")
+
+#++++++++++++++++++++++++++++++
+# Input arguments
+#++++++++++++++++++++++++++++++
+
+def add_arguments(parser):
+
+    """
+    Adds the command-line arguments of the model versus obs evaluation to parser.
+    """
+
+    parser.add_argument('--debug', action='store_true',
+                        help="Turn on debug output (False by default).")
+
+    parser.add_argument('--table', type=str,
+                        help="CSV table with the columns model_var,obs_file,obs_var and optionally "
+                        "name,model_units,obs_units (required)",
+                        required=True)
+
+    parser.add_argument('--modeldir', type=str,
+                        help="Comma separated directories (or zarr stores) with the model output of each "
+                        "case to evaluate (required)",
+                        required=True)
+
+    parser.add_argument('--pattern', type=str,
+                        default="*_regridded.nc",
+                        help="Pattern of the model files in each directory (default: *_regridded.nc)")
+
+    parser.add_argument('--outputfile', type=str,
+                        help="Full path of the summary CSV table to write (required)",
+                        required=True)
+
+    parser.add_argument('--plotdir', type=str,
+                        help="Directory for bias plots of every entry (optional, needs matplotlib and cartopy)")
+
+    parser.add_argument('--weight-file', type=str,
+                        help="ESMF map file of the SE grid, needed to evaluate native ncol/lndgrid model "
+                        "output; the observations are then mapped to the SE grid (optional)")
+
+    parser.add_argument("--workers",
+                        type=int,
+                        default=4,
+                        help="Number of threads evaluating observation products in parallel (default: 4)",
+                        )
+
+#++++++++++++++++++++++++++++++
+# main evaluation function
+#++++++++++++++++++++++++++++++
+
+def run(args):
+
+    """
+    Evaluates the model output of each case against the observations of the
+    table and writes one summary table for all cases.
+    """
+
+    from .evaluation import (
+        ModelObsEvaluator,
+        find_model_files,
+        load_model_means,
+        read_evaluation_table,
+        write_bias_plots,
+        write_summary,
+    )
+
+    entries = read_evaluation_table(args.table)
+    logger.info(f"Evaluating {len(entries)} entries of {args.table}")
+
+    native_regridder = None
+    if args.weight_file:
+        from .sparse_regridding import make_latlon_to_se_regridder
+
+        native_regridder = make_latlon_to_se_regridder(args.weight_file)
+
+    # observations and regridders are shared by the evaluations of all cases
+    evaluator = ModelObsEvaluator(entries, nworkers=args.workers, native_regridder=native_regridder)
+    model_vars = sorted({entry["model_var"] for entry in entries})
+    rows = []
+    for modeldir in args.modeldir.split(","):
+        case = os.path.basename(os.path.normpath(modeldir))
+        files = find_model_files(modeldir, pattern=args.pattern)
+        if not files:
+            logger.error(f"No model files matching {args.pattern} found in {modeldir}")
+            continue
+        logger.info(f"Reading time means of {len(model_vars)} variables from {len(files)} files of {case}")
+        model_means = load_model_means(files, model_vars)
+        case_rows, biases = evaluator.evaluate(model_means, case=case)
+        rows.extend(case_rows)
+        for row in case_rows:
+            if row.get("status") != "ok":
+                logger.warning(f"{case} {row['name']}: {row.get('status')}")
+        if args.plotdir:
+            write_bias_plots(biases, args.plotdir, case=case)
+
+    write_summary(rows, args.outputfile)
+    logger.info(f"Wrote evaluation summary {args.outputfile}")
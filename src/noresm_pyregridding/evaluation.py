@@ -0,0 +1,359 @@
+import csv
+import fnmatch
+import hashlib
+import logging
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import xarray as xr
+
+from .misc_help_functions import (
+    calculate_native_bias,
+    calculate_native_rmse_from_bias,
+    calculate_rmse_from_bias,
+    get_native_grid_dim,
+    get_unit_conversion_from_string,
+)
+from .noresm_pyregridding import make_regridder_regular_to_coarsest_resolution
+
+logger = logging.getLogger(__name__)
+
+# Columns of the evaluation table, the first three are required
+TABLE_COLUMNS = ("model_var", "obs_file", "obs_var", "name", "model_units", "obs_units")
+
+# Columns of the summary table written by write_summary
+SUMMARY_COLUMNS = (
+    "case",
+    "name",
+    "model_var",
+    "obs_file",
+    "obs_var",
+    "units",
+    "unit_conversion",
+    "grid",
+    "model_mean",
+    "obs_mean",
+    "bias",
+    "rmse",
+    "status",
+)
+
+# Alternative names of the horizontal coordinates in observation products
+_COORD_NAMES = {"latitude": "lat", "longitude": "lon"}
+
+
+def read_evaluation_table(path):
+    """
+    Read a CSV table of model variables and the observations to compare them
+    with. The columns are model_var, obs_file and obs_var, optionally name
+    (default: model_var, or model_var_vs_obs_var if model_var is used twice)
+    and model_units/obs_units to override the units attributes of the files.
+    Relative obs_file paths are relative to the table, lines starting with #
+    are ignored.
+    """
+    tabledir = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="") as fh:
+        lines = [line for line in fh if line.strip() and not line.lstrip().startswith("#")]
+    reader = csv.DictReader(lines, skipinitialspace=True)
+    missing = [col for col in TABLE_COLUMNS[:3] if col not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"Evaluation table {path} is missing the columns {missing}")
+
+    entries = []
+    for row in reader:
+        entry = {col: (row.get(col) or "").strip() or None for col in TABLE_COLUMNS}
+        entry["obs_file"] = os.path.join(tabledir, os.path.expanduser(entry["obs_file"]))
+        entries.append(entry)
+    model_vars = [entry["model_var"] for entry in entries]
+    for entry in entries:
+        if entry["name"] is None:
+            if model_vars.count(entry["model_var"]) > 1:
+                entry["name"] = f"{entry['model_var']}_vs_{entry['obs_var']}"
+            else:
+                entry["name"] = entry["model_var"]
+    names = [entry["name"] for entry in entries]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Evaluation table {path} has duplicate names {duplicates}")
+    return entries
+
+
+def find_model_files(path, pattern="*.nc"):
+    """Return the model files of a directory matching pattern, or [path] for a file or zarr store"""
+    if os.path.isdir(path) and not path.rstrip("/").endswith(".zarr"):
+        return sorted(
+            os.path.join(path, name)
+            for name in os.listdir(path)
+            if fnmatch.fnmatch(name, pattern)
+        )
+    return [path]
+
+
+def load_model_means(paths, variables):
+    """
+    Return a Dataset with the mean over all time samples of the variables in
+    the model files (or zarr stores) in paths. Only the requested variables
+    are read, one file at a time; variables that are not found are left out.
+    """
+    sums = {}
+    counts = {}
+    attrs = {}
+    for path in paths:
+        if path.rstrip("/").endswith(".zarr"):
+            ds = xr.open_zarr(path)
+        else:
+            ds = xr.open_dataset(path)
+        with ds:
+            for var in variables:
+                if var not in ds or var in attrs and "time" not in ds[var].dims:
+                    continue
+                da = ds[var].astype(np.float64)
+                if "time" in da.dims:
+                    total = da.sum("time", skipna=False).load()
+                    count = da.sizes["time"]
+                else:
+                    total = da.load()
+                    count = 1
+                sums[var] = total if var not in sums else sums[var] + total
+                counts[var] = counts.get(var, 0) + count
+                attrs[var] = ds[var].attrs
+    means = {}
+    for var, total in sums.items():
+        means[var] = total / counts[var]
+        means[var].attrs = attrs[var]
+    return xr.Dataset(means)
+
+
+def normalise_latlon(da):
+    """Rename latitude/longitude, sort latitudes and bring longitudes to 0-360"""
+    da = da.rename({name: new for name, new in _COORD_NAMES.items() if name in da.dims})
+    if "lat" not in da.dims or "lon" not in da.dims:
+        return da
+    da = da.assign_coords(lon=da["lon"] % 360)
+    return da.sortby("lat").sortby("lon")
+
+
+def get_grid_key(ds):
+    """Identifier of the lat/lon grid of a Dataset or DataArray"""
+    digest = hashlib.sha1()
+    for name in ("lat", "lon"):
+        digest.update(np.ascontiguousarray(ds[name].values, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+class ModelObsEvaluator:
+    """
+    Compares time mean model fields with observations for a table of entries.
+
+    Observation products are read once and kept as time means, and regridders
+    are built once per pair of model and observation grid, so evaluating
+    several cases reuses both. Entries that share an observation file, and
+    whose model fields have the same dimensions, are evaluated as one batch on
+    a worker thread: all their fields are regridded with a single call, and
+    bias, RMSE and global means are computed for all of them at once.
+
+    Model fields on the lat/lon grid are compared with
+    make_regridder_regular_to_coarsest_resolution, which regrids the finer
+    of the two grids to the coarser one. Model fields on the native ncol or
+    lndgrid grid need native_regridder, a LatLonToSERegridder that maps the
+    observations to the SE grid, the statistics are then area weighted.
+    """
+
+    def __init__(self, entries, nworkers=4, native_regridder=None):
+        self.entries = entries
+        self.nworkers = nworkers
+        self.native_regridder = native_regridder
+        self._obs = {}
+        self._regridders = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _key_lock(self, key):
+        # one lock per obs file or grid pair, so that each is only loaded or built once
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def load_obs(self, obs_file, obs_vars):
+        """Return the time means of obs_vars in obs_file, reading each once"""
+        with self._key_lock(("obs", obs_file)):
+            cached = self._obs.setdefault(obs_file, {})
+            missing = [var for var in obs_vars if var not in cached]
+            if missing:
+                logger.info(f"Reading {missing} from {obs_file}")
+                with xr.open_dataset(obs_file) as ds:
+                    for var in missing:
+                        da = ds[var]
+                        if "time" in da.dims:
+                            da = da.mean("time")
+                        cached[var] = normalise_latlon(da.astype(np.float64).load())
+                        cached[var].attrs = ds[var].attrs
+            return {var: cached[var] for var in obs_vars}
+
+    def get_regridder(self, model_ds, obs_ds):
+        """Return the regridder of a model and obs grid pair and whether the model grid is finer"""
+        key = (get_grid_key(model_ds), get_grid_key(obs_ds))
+        with self._key_lock(("regridder",) + key):
+            if key not in self._regridders:
+                logger.info(
+                    f"Creating regridder between model grid {dict(model_ds.sizes)} "
+                    f"and obs grid {dict(obs_ds.sizes)}"
+                )
+                self._regridders[key] = make_regridder_regular_to_coarsest_resolution(
+                    xr.Dataset(coords={"lat": model_ds["lat"], "lon": model_ds["lon"]}),
+                    xr.Dataset(coords={"lat": obs_ds["lat"], "lon": obs_ds["lon"]}),
+                )
+            return self._regridders[key]
+
+    def _compare_latlon(self, model_ds, obs_ds):
+        regridder, model_is_finer = self.get_regridder(model_ds, obs_ds)
+        if regridder is None:
+            obs_ds = obs_ds.assign_coords(lat=model_ds["lat"].values, lon=model_ds["lon"].values)
+            grid = "same grid"
+        elif model_is_finer:
+            model_ds = regridder(model_ds)
+            grid = "model to obs grid"
+        else:
+            obs_ds = regridder(obs_ds)
+            grid = "obs to model grid"
+        model, obs = xr.align(model_ds.to_array("entry"), obs_ds.to_array("entry"), join="inner")
+        valid = model.notnull() & obs.notnull()
+        model = model.where(valid)
+        obs = obs.where(valid)
+        bias = model - obs
+        rmse, bias_gm = calculate_rmse_from_bias(bias)
+        weights = np.cos(np.deg2rad(bias.lat))
+        model_gm = model.weighted(weights).mean(["lon", "lat"]).values
+        obs_gm = obs.weighted(weights).mean(["lon", "lat"]).values
+        return bias, grid, model_gm, obs_gm, bias_gm, rmse
+
+    def _compare_native(self, model_ds, obs_ds, dimname):
+        if self.native_regridder is None:
+            raise ValueError(f"Model data is on the native {dimname} grid, a native regridder is needed")
+        obs_ds = self.native_regridder(obs_ds, dimname=dimname)
+        model = model_ds.to_array("entry")
+        obs = obs_ds.to_array("entry")
+        valid = model.notnull() & obs.notnull()
+        model = model.where(valid)
+        obs = obs.where(valid)
+        bias = calculate_native_bias(model, obs)
+        area = self.native_regridder.cell_areas(dimname)
+        rmse, bias_gm = calculate_native_rmse_from_bias(bias, area)
+        model_gm = model.weighted(area).mean(dimname).values
+        obs_gm = obs.weighted(area).mean(dimname).values
+        return bias, "obs to native grid", model_gm, obs_gm, bias_gm, rmse
+
+    def evaluate_batch(self, model_means, entries):
+        """
+        Evaluate entries sharing one observation file, returning a summary row
+        for each entry and the bias fields (None on the native grid).
+        """
+        obs_fields = self.load_obs(entries[0]["obs_file"], [entry["obs_var"] for entry in entries])
+        model_fields = {}
+        obs_batch = {}
+        rows = {}
+        for entry in entries:
+            model = normalise_latlon(model_means[entry["model_var"]])
+            obs = obs_fields[entry["obs_var"]]
+            obs_unit = entry["obs_units"] or obs.attrs.get("units")
+            model_unit = entry["model_units"] or model.attrs.get("units")
+            factor, unit = get_unit_conversion_from_string(obs_unit, model_unit)
+            model_fields[entry["name"]] = model * factor
+            obs_batch[entry["name"]] = obs
+            rows[entry["name"]] = {"units": unit, "unit_conversion": factor}
+
+        model_ds = xr.Dataset(model_fields)
+        obs_ds = xr.Dataset(obs_batch)
+        dimname = get_native_grid_dim(model_ds)
+        horizontal = {"lat", "lon"} if dimname is None else {dimname}
+        extra = sorted((set(model_ds.dims) - horizontal) | (set(obs_ds.dims) - {"lat", "lon"}))
+        if extra:
+            raise ValueError(f"Only horizontal fields can be evaluated, found the dimensions {extra}")
+        if dimname is None:
+            bias, grid, model_gm, obs_gm, bias_gm, rmse = self._compare_latlon(model_ds, obs_ds)
+        else:
+            bias, grid, model_gm, obs_gm, bias_gm, rmse = self._compare_native(model_ds, obs_ds, dimname)
+
+        for i, name in enumerate(bias["entry"].values):
+            rows[name].update(
+                grid=grid,
+                model_mean=float(model_gm[i]),
+                obs_mean=float(obs_gm[i]),
+                bias=float(bias_gm[i]),
+                rmse=float(rmse[i]),
+                status="ok",
+            )
+        return rows, (None if dimname is not None else bias)
+
+    def evaluate(self, model_means, case=""):
+        """
+        Evaluate all entries against model_means (see load_model_means) with
+        one batch per observation file and model field dimensions on a pool of
+        worker threads. Returns the summary rows and a dict of the bias fields
+        of each batch.
+        """
+        batches = {}
+        rows = {}
+        for entry in self.entries:
+            rows[entry["name"]] = {
+                "case": case,
+                **{col: entry[col] for col in ("name", "model_var", "obs_file", "obs_var")},
+            }
+            if entry["model_var"] not in model_means:
+                rows[entry["name"]]["status"] = f"{entry['model_var']} not found in model output"
+                continue
+            # fields with different dimensions are stacked in separate batches,
+            # so that e.g. a 3-D field does not broadcast the 2-D fields of its obs file
+            key = (entry["obs_file"], model_means[entry["model_var"]].dims)
+            batches.setdefault(key, []).append(entry)
+
+        biases = {}
+        with ThreadPoolExecutor(max_workers=self.nworkers) as pool:
+            futures = {
+                key: pool.submit(self.evaluate_batch, model_means, entries)
+                for key, entries in batches.items()
+            }
+            for key, future in futures.items():
+                try:
+                    batch_rows, bias = future.result()
+                except Exception as err:
+                    names = [entry["name"] for entry in batches[key]]
+                    logger.error(f"Evaluation of {names} against {key[0]} failed: {err}")
+                    for entry in batches[key]:
+                        rows[entry["name"]]["status"] = f"failed: {err}"
+                    continue
+                for name, row in batch_rows.items():
+                    rows[name].update(row)
+                if bias is not None:
+                    biases[key] = bias
+        return [rows[entry["name"]] for entry in self.entries], biases
+
+
+def write_summary(rows, path):
+    """Write the summary rows of one or more evaluations to a CSV file"""
+    with open(path, "w", newline="") as fh:
+        writer = csv.DictWriter(fh, fieldnames=SUMMARY_COLUMNS, restval="")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({col: row.get(col, "") for col in SUMMARY_COLUMNS})
+
+
+def write_bias_plots(biases, plotdir, case=""):
+    """Plot the bias field of every entry with make_bias_plot"""
+    # plotting needs matplotlib and cartopy, which are only imported when asked for
+    import matplotlib.pyplot as plt
+
+    from .plotting_utils import make_bias_plot
+
+    os.makedirs(plotdir, exist_ok=True)
+    prefix = f"{case}_" if case else ""
+    for bias in biases.values():
+        for name in bias["entry"].values:
+            make_bias_plot(
+                bias.sel(entry=name, drop=True).rename(name),
+                os.path.join(plotdir, f"{prefix}{name}_bias"),
+                cmap="RdYlBu_r",
+            )
+            plt.close("all")
@@ -0,0 +1,269 @@
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Name of the persistent index written into the scanned directory by default
+CATALOG_INDEX_NAME = ".noresm_pyregridding_catalog.json"
+
+# Bump when the layout of a catalog entry changes, older indexes are then discarded
+CATALOG_VERSION = 2
+
+# Minimum number of seconds between rewrites of the index by update()
+CATALOG_SAVE_INTERVAL = 300.0
+
+# Spectral element column dimension for each model component
+SE_GRID_DIMS = {"ncol": "atm", "lndgrid": "lnd"}
+
+# Matches e.g. "case.cam.h0a.0001-01.nc" or "case.clm2.h1.0001-01-01-00000.nc"
+_HISTORY_STREAM_RE = re.compile(r"\.([A-Za-z0-9_]+)\.(h[0-9]+[a-z]?)\.")
+
+
+def get_cache_dir():
+    """Directory for cached operators and indexes, $XDG_CACHE_HOME/noresm_pyregridding"""
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, "noresm_pyregridding")
+
+
+def default_index_file(inputdir):
+    """
+    Return the default index of inputdir: CATALOG_INDEX_NAME in inputdir if it
+    is writable, otherwise a file in get_cache_dir() named by its path.
+    """
+    inputdir = os.path.abspath(inputdir)
+    if os.access(inputdir, os.W_OK):
+        return os.path.join(inputdir, CATALOG_INDEX_NAME)
+    digest = hashlib.sha1(inputdir.encode()).hexdigest()[:16]
+    return os.path.join(get_cache_dir(), "catalogs", f"{digest}.json")
+
+
+def get_history_stream(filename):
+    """Return the history stream of a file name (e.g. "cam.h0a"), or None"""
+    match = _HISTORY_STREAM_RE.search(os.path.basename(filename))
+    if match is None:
+        return None
+    return f"{match.group(1)}.{match.group(2)}"
+
+
+def read_history_file_header(filepath):
+    """
+    Read the header information needed to regrid or make time series from a
+    history file without loading any of the field data. Only the fields
+    needed to select files are kept, so the index stays small for long runs.
+    """
+    # imported here, so that listing the files of an up to date index stays fast
+    import cftime
+    import xarray as xr
+
+    with xr.open_dataset(filepath, decode_times=False) as ds:
+        dims = {name: int(size) for name, size in ds.sizes.items()}
+        grid_dim = None
+        for dimname in SE_GRID_DIMS:
+            if dimname in dims:
+                grid_dim = dimname
+                break
+        entry = {
+            "grid_dim": grid_dim,
+            "realm": SE_GRID_DIMS.get(grid_dim),
+            "stream": get_history_stream(filepath),
+            "ntime": dims.get("time", 0),
+            "time_start": None,
+            "time_end": None,
+            "year_start": None,
+            "year_end": None,
+        }
+        if "time" in ds.variables and ds["time"].size > 0:
+            time = ds["time"]
+            time = cftime.num2date(
+                time.values.ravel()[[0, -1]],
+                time.attrs["units"],
+                calendar=time.attrs.get("calendar", "standard"),
+            )
+            entry["time_start"] = time[0].isoformat()
+            entry["time_end"] = time[-1].isoformat()
+            entry["year_start"] = int(time[0].year)
+            entry["year_end"] = int(time[-1].year)
+    return entry
+
+
+class HistoryFileCatalog:
+    """
+    Catalog of the NetCDF history files in a case directory.
+
+    File headers are read in a thread pool and cached in a JSON index keyed by
+    file name, modification time and size, so that later scans only need to
+    open files that are new or have changed since the index was written.
+    The index is kept in the directory itself, or in get_cache_dir() if the
+    directory is not writable.
+    """
+
+    def __init__(self, inputdir, index_file=None, nthreads=8, save_interval=CATALOG_SAVE_INTERVAL):
+        self.inputdir = os.fspath(inputdir)
+        if index_file is None:
+            index_file = default_index_file(self.inputdir)
+        self.index_file = os.fspath(index_file)
+        self.nthreads = nthreads
+        self.save_interval = save_interval
+        self.entries = {}
+        self._unsaved = False
+        self._last_save = time.monotonic()
+        self._load_index()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_file):
+            return
+        try:
+            with open(self.index_file) as fh:
+                index = json.load(fh)
+        except (OSError, ValueError) as err:
+            logger.warning(f"Ignoring unreadable catalog index {self.index_file}: {err}")
+            return
+        if index.get("version") != CATALOG_VERSION:
+            logger.info(f"Catalog index {self.index_file} is outdated, rebuilding")
+            return
+        self.entries = index.get("files", {})
+
+    def save(self):
+        """Write the index atomically, warning if it cannot be written"""
+        index = {"version": CATALOG_VERSION, "files": self.entries}
+        tmpfile = f"{self.index_file}.{os.getpid()}.tmp"
+        self._unsaved = False
+        self._last_save = time.monotonic()
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.index_file)), exist_ok=True)
+            with open(tmpfile, "w") as fh:
+                json.dump(index, fh, separators=(",", ":"))
+            os.replace(tmpfile, self.index_file)
+        except OSError as err:
+            logger.warning(f"Could not write catalog index {self.index_file}: {err}")
+
+    def flush(self):
+        """Write the index if update() has deferred saving any changes"""
+        if self._unsaved:
+            self.save()
+
+    def scan(self, pattern="*.nc", save=True):
+        """
+        Walk the directory once and (re)read the headers of new or modified
+        files matching pattern. Files that have disappeared are dropped from
+        the index. Returns the list of matching file paths, sorted by name.
+        """
+        current = {}
+        with os.scandir(self.inputdir) as it:
+            for dirent in it:
+                if not dirent.is_file() or not fnmatch.fnmatch(dirent.name, pattern):
+                    continue
+                stat = dirent.stat()
+                current[dirent.name] = (stat.st_mtime, stat.st_size)
+
+        stale = self._stale(current)
+        removed = [
+            name
+            for name in self.entries
+            if fnmatch.fnmatch(name, pattern) and name not in current
+        ]
+        for name in removed:
+            del self.entries[name]
+
+        if stale:
+            logger.info(
+                f"Reading headers of {len(stale)} of {len(current)} files in {self.inputdir}"
+            )
+            self._read_headers(stale, current)
+
+        if save and (stale or removed or self._unsaved):
+            self.save()
+        return self.files(pattern=pattern)
+
+    def update(self, filepaths, save=True):
+        """
+        (Re)read the headers of the given files in the directory if they are
+        new or modified, without walking the rest of the directory. As this
+        is called for every batch in watch mode, the index is rewritten at
+        most every save_interval seconds, call flush() to write the rest.
+        """
+        current = {}
+        for filepath in filepaths:
+            stat = os.stat(filepath)
+            current[os.path.basename(filepath)] = (stat.st_mtime, stat.st_size)
+        stale = self._stale(current)
+        if stale:
+            self._read_headers(stale, current)
+            self._unsaved = True
+        if save and self._unsaved and time.monotonic() - self._last_save >= self.save_interval:
+            self.save()
+
+    def _stale(self, current):
+        return [
+            name
+            for name, (mtime, size) in current.items()
+            if name not in self.entries
+            or self.entries[name]["mtime"] != mtime
+            or self.entries[name]["size"] != size
+        ]
+
+    def _read_headers(self, names, stats):
+        paths = [os.path.join(self.inputdir, name) for name in names]
+        with ThreadPoolExecutor(max_workers=self.nthreads) as pool:
+            headers = pool.map(self._read_header_or_none, paths)
+            for name, header in zip(names, headers):
+                if header is None:
+                    self.entries.pop(name, None)
+                    continue
+                mtime, size = stats[name]
+                header["mtime"] = mtime
+                header["size"] = size
+                self.entries[name] = header
+
+    @staticmethod
+    def _read_header_or_none(filepath):
+        try:
+            return read_history_file_header(filepath)
+        except Exception as err:
+            logger.warning(f"Could not read header of {filepath}: {err}")
+            return None
+
+    def files(self, pattern="*", realm=None, stream=None, years=None):
+        """
+        Return the sorted file paths in the index matching the given file name
+        pattern, realm ("atm" or "lnd"), history stream and inclusive
+        (first, last) range of years.
+        """
+        selected = []
+        for name in sorted(self.entries):
+            entry = self.entries[name]
+            if not fnmatch.fnmatch(name, pattern):
+                continue
+            if realm is not None and entry["realm"] != realm:
+                continue
+            if stream is not None and entry["stream"] != stream:
+                continue
+            if years is not None:
+                if entry["year_start"] is None:
+                    continue
+                if entry["year_end"] < years[0] or entry["year_start"] > years[1]:
+                    continue
+            selected.append(os.path.join(self.inputdir, name))
+        return selected
+
+    def __contains__(self, filepath):
+        return os.path.basename(filepath) in self.entries
+
+    def entry(self, filepath):
+        """Return the cached header information of a file in the catalog"""
+        return self.entries[os.path.basename(filepath)]
+
+    def streams(self, pattern="*"):
+        """Group the indexed files matching pattern by history stream"""
+        groups = {}
+        for filepath in self.files(pattern=pattern):
+            stream = self.entry(filepath)["stream"]
+            groups.setdefault(stream, []).append(filepath)
+        return groups
@@ -183,3 +183,32 @@ def calculate_rmse_from_bias(bias, weights=None):
     weighted = bias.weighted(weights)
     bias_gm = weighted.mean(["lon", "lat"]).values
     return rmse, bias_gm
+
+
+def get_native_grid_dim(da):
+    for dimname in ("ncol", "lndgrid"):
+        if dimname in da.dims:
+            return dimname
+    return None
+
+
+def calculate_native_bias(model, obs_native, unit_conversion=1):
+    # model output and observations already mapped to the spectral element grid,
+    # e.g. with sparse_regridding.make_latlon_to_se_regridder
+    return model * unit_conversion - obs_native
+
+
+def calculate_native_rmse_from_bias(bias, area):
+    dimname = get_native_grid_dim(bias)
+    if dimname is None:
+        raise ValueError(f"Neither ncol or lndgrid are dimensions of the bias {bias.dims}")
+    if not isinstance(area, xr.DataArray):
+        area = xr.DataArray(np.asarray(area), dims=(dimname,))
+    elif area.dims != (dimname,):
+        area = area.rename({area.dims[0]: dimname})
+    bias_square = (bias) ** 2
+    weighted = bias_square.weighted(area)
+    rmse = np.sqrt(weighted.mean(dimname).values)
+    weighted = bias.weighted(area)
+    bias_gm = weighted.mean(dimname).values
+    return rmse, bias_gm
@@ -1,7 +1,26 @@
 import numpy as np
 import xarray as xr
 import math
-import xesmf
+
+from typing import TYPE_CHECKING
+
+from .sparse_regridding import SparseRegridder
+
+# xesmf (and ESMF) take seconds to import, so they are only imported by the
+# functions that build an xesmf regridder
+if TYPE_CHECKING:
+    import xesmf
+
+# Supported precision modes of the regridding:
+#  float64: weights, accumulation and output in float64 (xESMF default)
+#  float32: weights, accumulation and output in float32
+#  mixed:   float64 weights and accumulation, output cast back to the input dtype
+PRECISIONS = ("float64", "float32", "mixed")
+
+
+def check_precision(precision):
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision must be one of {PRECISIONS}, got {precision}")
 
 
 def make_regridder_regular_to_coarsest_resolution(regrid_target1, regrid_target2):
@@ -24,6 +43,9 @@ def make_regular_grid_regridder(regrid_start, regrid_target, method="bilinear"):
         np.abs(regrid_target["lat"].values - regrid_start["lat"].values.max())
     )
     regrid_target = regrid_target.isel(lat=slice(lat_min, lat_max))
+
+    import xesmf
+
     return xesmf.Regridder(
         regrid_start,
         regrid_target,
@@ -40,7 +62,8 @@ def make_generic_regridder(weightfile, filename_exmp):
         return make_se_regridder(weight_file=weightfile)
 
 
-def make_se_regridder(weight_file, regrid_method="conserved"):
+def make_se_regridder(weight_file, regrid_method="conserved", precision="float64"):
+    check_precision(precision)
     weights = xr.open_dataset(weight_file)
     in_shape = weights.src_grid_dims.load().data
 
@@ -75,6 +98,8 @@ def make_se_regridder(weight_file, regrid_method="conserved"):
         }
     )
 
+    import xesmf
+
     regridder = xesmf.Regridder(
         dummy_in,
         dummy_out,
@@ -83,19 +108,104 @@ def make_se_regridder(weight_file, regrid_method="conserved"):
         reuse_weights=True,
         periodic=True,
     )
+    if precision == "float32":
+        # halves the memory traffic of the sparse matrix multiplication
+        regridder.weights = regridder.weights.astype(np.float32)
     return regridder
 
 
+def make_target_cell_areas(weight_file):
+    """
+    Return the target grid cell areas (in steradians) of a weight file on the
+    regridded lat/lon grid, for computing conservative global integrals.
+    """
+    weights = xr.open_dataset(weight_file)
+    out_shape = weights.dst_grid_dims.load().data.tolist()[::-1]
+    return xr.DataArray(
+        weights.area_b.data.reshape(out_shape),
+        dims=("lat", "lon"),
+        coords={
+            "lat": weights.yc_b.data.reshape(out_shape)[:, 0],
+            "lon": weights.xc_b.data.reshape(out_shape)[0, :],
+        },
+        name="area",
+    )
+
+
+def _cast_to_precision(ds, vars_to_cast, precision):
+    """Cast the floating point variables in vars_to_cast to the dtype used for regridding"""
+    if precision == "float64":
+        return ds
+    dtype = np.float32 if precision == "float32" else np.float64
+    for var in vars_to_cast:
+        if np.issubdtype(ds[var].dtype, np.floating):
+            ds[var] = ds[var].astype(dtype)
+    return ds
+
+
+def _cast_regridded_output(ds_out, input_dtypes, precision):
+    """
+    Cast the regridded floating point variables back to the output precision.
+    In mixed mode only floating point inputs are cast back, regridded integer
+    fields (e.g. landmask) are fractional and keep the float output.
+    """
+    if precision == "float64":
+        return ds_out
+    for var, dtype in input_dtypes.items():
+        if var not in ds_out or not np.issubdtype(ds_out[var].dtype, np.floating):
+            continue
+        if precision == "mixed" and not np.issubdtype(dtype, np.floating):
+            continue
+        out_dtype = np.float32 if precision == "float32" else dtype
+        if ds_out[var].dtype != out_dtype:
+            ds_out[var] = ds_out[var].astype(out_dtype)
+    return ds_out
+
+
+def _regrid_masked_landfrac(regridder, ds_in, landfrac, vars_to_mask, skipna, na_thres):
+    """
+    Regrid landfrac with the missing value pattern of each variable, for
+    normalising land variables with missing values with an xesmf regridder.
+    The sparse engine instead maps the land fraction of every missing value
+    pattern once and caches it, see SparseRegridder.apply.
+    """
+    masked = {}
+    for var in vars_to_mask:
+        mask = ds_in[var].notnull()
+        if bool(mask.all()):
+            continue
+        masked[var] = xr.where(mask, landfrac, np.nan).transpose(*mask.dims)
+    if not masked:
+        return {}
+    regridded = regridder(
+        xr.Dataset(masked).rename({"dummy": "lat", "lndgrid": "lon"}),
+        skipna=skipna,
+        na_thres=na_thres,
+    )
+    return {var: regridded[var] for var in masked}
+
+
 def regrid_ctsm_se_data(
-    regridder: xesmf.Regridder, ds_in: xr.Dataset, debug: bool
+    regridder: "xesmf.Regridder",
+    ds_in: xr.Dataset,
+    debug: bool,
+    precision: str = "float64",
+    skipna: bool = False,
+    na_thres: float = 1.0,
 ) -> xr.Dataset:
 
     if regridder is None:
         print(f"No data to regrid, returning")
         return ds_in
+    check_precision(precision)
 
     dimname = "lndgrid"
 
+    # regional regridders only need the source columns contributing to the region
+    src_indices = getattr(regridder, "src_indices", None)
+    if src_indices is not None and ds_in.sizes[dimname] != len(src_indices):
+        ds_in = ds_in.isel({dimname: src_indices})
+
     # make a copy of input dataset
     ds_in_copy = ds_in.copy()
 
@@ -118,6 +228,10 @@ def regrid_ctsm_se_data(
     # determine list of variables that will not be normalized
     exclude_normalization_vars = ["landfrac", "landmask"]
 
+    # record the input dtypes and cast to the precision used for regridding
+    input_dtypes = {var: ds_in[var].dtype for var in vars_to_regrid}
+    ds_in_copy = _cast_to_precision(ds_in_copy, vars_to_regrid, precision)
+
     # normalize input vars by landfrac and also multiply FATES specific variable by FATES_FRACTION
     landfrac = ds_in["landfrac"].fillna(0)
     for var in vars_to_regrid:
@@ -136,34 +250,68 @@ def regrid_ctsm_se_data(
             if var.startswith("FATES") and var != "FATES_FRACTION":
                 ds_in_copy[var] = ds_in_copy[var] * ds_in_copy["FATES_FRACTION"]
 
-    # regrid data
-    ds_out = regridder(ds_in_copy.rename({"dummy": "lat", dimname: "lon"}))
+    # regrid data, with skipna missing values are ignored instead of spreading
+    # over all target cells they contribute to
+    regrid_kwargs = {"skipna": skipna, "na_thres": na_thres} if skipna else {}
+    vars_to_normalize = [var for var in vars_to_regrid if var not in exclude_normalization_vars]
+    ds_to_regrid = ds_in_copy.rename({"dummy": "lat", dimname: "lon"})
+    if skipna and isinstance(regridder, SparseRegridder):
+        # with skipna, variables are normalized by the land fraction mapped from
+        # their valid cells only, which the sparse engine maps once for every
+        # missing value pattern and caches
+        src_weights = {var: landfrac.values for var in vars_to_normalize}
+        return _cast_regridded_output(
+            regridder(ds_to_regrid, src_weights=src_weights, **regrid_kwargs), input_dtypes, precision
+        )
+    ds_out = regridder(ds_to_regrid, **regrid_kwargs)
+
+    # with skipna, variables with missing values are normalized by the land
+    # fraction mapped from their valid cells only
+    masked_landfrac = {}
+    if skipna:
+        masked_landfrac = _regrid_masked_landfrac(
+            regridder, ds_in_copy, landfrac, vars_to_normalize, skipna, na_thres
+        )
 
     # normalize the mapped land data by dividing by the mapped land fraction
-    for var in vars_to_regrid:
-        if var not in exclude_normalization_vars:
-            ds_out[var] = ds_out[var] / ds_out["landfrac"]
+    for var in vars_to_normalize:
+        ds_out[var] = ds_out[var] / masked_landfrac.get(var, ds_out["landfrac"])
 
     # return regridded dataset
-    return ds_out
+    return _cast_regridded_output(ds_out, input_dtypes, precision)
 
 
 def regrid_cam_se_data(
-    regridder: xesmf.Regridder, ds_in: xr.Dataset, debug: bool
+    regridder: "xesmf.Regridder",
+    ds_in: xr.Dataset,
+    debug: bool,
+    precision: str = "float64",
+    skipna: bool = False,
+    na_thres: float = 1.0,
 ) -> xr.Dataset:
 
     if regridder is None:
         print(f"No data to regrid, returning")
         return ds_in
+    check_precision(precision)
 
     dimname = "ncol"
 
+    # regional regridders only need the source columns contributing to the region
+    src_indices = getattr(regridder, "src_indices", None)
+    if src_indices is not None and ds_in.sizes[dimname] != len(src_indices):
+        ds_in = ds_in.isel({dimname: src_indices})
+
     # make a copy of input dataset
     ds_in_copy = ds_in.copy()
 
     # determine variables that will be regridded
     vars_to_regrid = [name for name in ds_in.data_vars if dimname in ds_in[name].dims]
 
+    # record the input dtypes and cast to the precision used for regridding
+    input_dtypes = {var: ds_in[var].dtype for var in vars_to_regrid}
+    ds_in_copy = _cast_to_precision(ds_in_copy, vars_to_regrid, precision)
+
     for var in vars_to_regrid:
         if debug:
             print(f"var is {var}")
@@ -171,8 +319,10 @@ def regrid_cam_se_data(
             ds_in_copy[var].transpose(..., dimname).expand_dims("dummy", axis=-2)
         )
 
-    # regrid all the variables
-    ds_out = regridder(ds_in_copy.rename({"dummy": "lat", dimname: "lon"}))
+    # regrid all the variables, with skipna missing values are ignored instead
+    # of spreading over all target cells they contribute to
+    regrid_kwargs = {"skipna": skipna, "na_thres": na_thres} if skipna else {}
+    ds_out = regridder(ds_in_copy.rename({"dummy": "lat", dimname: "lon"}), **regrid_kwargs)
 
     # return regridded dataset
-    return ds_out
+    return _cast_regridded_output(ds_out, input_dtypes, precision)
@@ -0,0 +1,261 @@
+import logging
+import queue
+import threading
+import time
+
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the items on a queue
+_DONE = object()
+
+
+class StageStats:
+    """Busy time and item count of one pipeline stage, shared by its threads"""
+
+    def __init__(self, name, nthreads):
+        self.name = name
+        self.nthreads = nthreads
+        self.items = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self.items += 1
+            self.busy += seconds
+
+    def utilisation(self, wall):
+        if wall <= 0:
+            return 0.0
+        return self.busy / (wall * self.nthreads)
+
+
+class QueueStats:
+    """Depth of a bounded queue, sampled every time an item is put on it"""
+
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self.samples = 0
+        self.total_depth = 0
+        self.max_depth = 0
+        self.full_waits = 0
+        self._lock = threading.Lock()
+
+    def sample(self, depth, waited):
+        with self._lock:
+            self.samples += 1
+            self.total_depth += depth
+            self.max_depth = max(self.max_depth, depth)
+            if waited:
+                self.full_waits += 1
+
+    @property
+    def mean_depth(self):
+        return self.total_depth / self.samples if self.samples else 0.0
+
+
+class RegridPipeline:
+    """
+    Overlaps reading, regridding and writing of a sequence of files.
+
+    Reader threads call read(item) ahead of the compute stage, the compute
+    stage calls compute(data, *compute_args) and writer threads call
+    write(item, result). The stages are connected by bounded queues, so
+    readers stop prefetching when the compute stage falls behind and the
+    compute stage stops when writers fall behind, keeping at most about
+    queue_size files in memory per queue.
+
+    Without a dask client the compute stage runs in the calling thread. With
+    a client, up to queue_size computations are submitted to the cluster at
+    a time; compute_args may then contain futures, e.g. a scattered regridder.
+    """
+
+    def __init__(
+        self,
+        read,
+        compute,
+        write,
+        nreaders=1,
+        nwriters=1,
+        queue_size=2,
+        client=None,
+        compute_args=(),
+    ):
+        if min(nreaders, nwriters, queue_size) < 1:
+            raise ValueError(
+                f"nreaders, nwriters and queue_size must be at least 1, "
+                f"got {nreaders}, {nwriters} and {queue_size}"
+            )
+        self.read = read
+        self.compute = compute
+        self.write = write
+        self.nreaders = nreaders
+        self.nwriters = nwriters
+        self.queue_size = queue_size
+        self.client = client
+        self.compute_args = tuple(compute_args)
+        self.stages = {
+            "read": StageStats("read", nreaders),
+            # with dask, up to queue_size computations run at the same time
+            "compute": StageStats("compute", 1 if client is None else queue_size),
+            "write": StageStats("write", nwriters),
+        }
+        self.queues = {
+            "read": QueueStats("read", queue_size),
+            "write": QueueStats("write", queue_size),
+        }
+        self.wall = 0.0
+        self._error = None
+        self._stop = threading.Event()
+
+    def _put(self, q, stats, value):
+        waited = q.full()
+        while not self._stop.is_set():
+            try:
+                q.put(value, timeout=0.1)
+            except queue.Full:
+                continue
+            stats.sample(q.qsize(), waited)
+            return True
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _fail(self, err):
+        if self._error is None:
+            self._error = err
+        self._stop.set()
+
+    def _reader(self, items, read_queue):
+        while True:
+            try:
+                item = items.popleft()
+            except IndexError:
+                break
+            try:
+                start = time.perf_counter()
+                data = self.read(item)
+                self.stages["read"].add(time.perf_counter() - start)
+            except Exception as err:
+                logger.error(f"Reading {item} failed: {err}")
+                self._fail(err)
+                break
+            if not self._put(read_queue, self.queues["read"], (item, data)):
+                break
+        self._put(read_queue, self.queues["read"], _DONE)
+
+    def _writer(self, write_queue):
+        while True:
+            entry = self._get(write_queue)
+            if entry is _DONE:
+                break
+            item, result = entry
+            try:
+                start = time.perf_counter()
+                self.write(item, result)
+                self.stages["write"].add(time.perf_counter() - start)
+            except Exception as err:
+                logger.error(f"Writing {item} failed: {err}")
+                self._fail(err)
+                break
+
+    def _compute_local(self, read_queue, write_queue):
+        finished_readers = 0
+        while finished_readers < self.nreaders:
+            entry = self._get(read_queue)
+            if entry is _DONE:
+                if self._stop.is_set():
+                    return
+                finished_readers += 1
+                continue
+            item, data = entry
+            start = time.perf_counter()
+            result = self.compute(data, *self.compute_args)
+            self.stages["compute"].add(time.perf_counter() - start)
+            if not self._put(write_queue, self.queues["write"], (item, result)):
+                return
+
+    def _compute_dask(self, read_queue, write_queue):
+        in_flight = deque()
+        finished_readers = 0
+
+        def collect_oldest():
+            item, future, submitted = in_flight.popleft()
+            result = future.result()
+            self.stages["compute"].add(time.perf_counter() - submitted)
+            return self._put(write_queue, self.queues["write"], (item, result))
+
+        while finished_readers < self.nreaders:
+            entry = self._get(read_queue)
+            if entry is _DONE:
+                if self._stop.is_set():
+                    return
+                finished_readers += 1
+                continue
+            item, data = entry
+            future = self.client.submit(self.compute, data, *self.compute_args, pure=False)
+            in_flight.append((item, future, time.perf_counter()))
+            # results are passed on in submission order to bound the work in flight
+            if len(in_flight) >= self.queue_size and not collect_oldest():
+                return
+        while in_flight:
+            if not collect_oldest():
+                return
+
+    def run(self, items):
+        """Process all items, re-raising the first error of any stage"""
+        items = deque(items)
+        read_queue = queue.Queue(maxsize=self.queue_size)
+        write_queue = queue.Queue(maxsize=self.queue_size)
+        readers = [
+            threading.Thread(target=self._reader, args=(items, read_queue), daemon=True)
+            for _ in range(self.nreaders)
+        ]
+        writers = [
+            threading.Thread(target=self._writer, args=(write_queue,), daemon=True)
+            for _ in range(self.nwriters)
+        ]
+        start = time.perf_counter()
+        for thread in readers + writers:
+            thread.start()
+        try:
+            if self.client is None:
+                self._compute_local(read_queue, write_queue)
+            else:
+                self._compute_dask(read_queue, write_queue)
+        except BaseException as err:
+            self._fail(err)
+        for _ in writers:
+            self._put(write_queue, self.queues["write"], _DONE)
+        for thread in readers + writers:
+            thread.join()
+        self.wall = time.perf_counter() - start
+        if self._error is not None:
+            raise self._error
+        return self
+
+    def report(self):
+        """Summarise stage utilisation and queue depths of the last run"""
+        lines = [f"Pipeline wall time {self.wall:.1f}s"]
+        for stage in self.stages.values():
+            lines.append(
+                f"  {stage.name:>8}: {stage.items} items, busy {stage.busy:.1f}s, "
+                f"utilisation {100 * stage.utilisation(self.wall):.0f}% "
+                f"of {stage.nthreads} thread(s)"
+            )
+        for stats in self.queues.values():
+            lines.append(
+                f"  {stats.name:>8} queue: mean depth {stats.mean_depth:.1f}, "
+                f"max depth {stats.max_depth} of {stats.maxsize}, "
+                f"{stats.full_waits} puts waited on a full queue"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,518 @@
+import functools
+import logging
+import os
+import threading
+
+from pathlib import Path
+
+from .history_catalog import HistoryFileCatalog
+from .pipeline import RegridPipeline
+from .watch import HistoryFileWatcher, install_shutdown_handlers, watch
+
+# Only light modules are imported above: xarray, xesmf, dask and zarr are
+# imported by the functions that need them, so that --help and runs where
+# every output already exists return without loading them.
+
+logger = logging.getLogger("noresm_pyregridding")
+
+# Conservative weight files for each supported input grid
+WEIGHT_FILES = {
+    "ne16": "/datalake/NS9560K/diagnostics/land_xesmf_diag_data/map_ne16pg3_to_1.9x2.5_nomask_scripgrids_c250425.nc",
+    "ne30": "/datalake/NS9560K/diagnostics/land_xesmf_diag_data/map_ne30pg3_to_0.5x0.5_nomask_aave_da_c180515.nc",
+}
+
+#++++++++++++++++++++++++++++++
+# Input arguments
+#++++++++++++++++++++++++++++++
+
+def add_arguments(parser):
+
+    """
+    Adds the command-line arguments of the folder regridding to parser.
+    """
+
+    parser.add_argument('--debug', action='store_true',
+                        help="Turn on debug output (False by default).")
+
+    parser.add_argument("--realm",
+                        choices=["atm","lnd"],
+                        help="Realm to process (required)",
+                        required=True,)
+
+    parser.add_argument('--inputdir', type=str,
+                        help="Full pathname of directory containing input spectral element data files (required)",
+                        required=True)
+
+    parser.add_argument('--outputdir', type=str,
+                        help="Full path to directory where output regridded data will be placed (required)",
+                        required=True)
+
+    parser.add_argument ('--inputres', type=str,
+                         choices=sorted(WEIGHT_FILES),
+                         help="input_grid name (required)",
+                         required=True)
+
+    parser.add_argument("--workers",
+                        type=int,
+                        default=1,
+                        help="Number of Dask workers (default: 1, set to >1 for parallel execution)",
+                        )
+
+    parser.add_argument("--engine",
+                        choices=["xesmf","sparse"],
+                        default="xesmf",
+                        help="Regridding engine: xesmf, or sparse which applies the weights of the map file "
+                        "with scipy in a thread pool and does not need ESMF (default: xesmf)",
+                        )
+
+    parser.add_argument("--threads",
+                        type=int,
+                        default=1,
+                        help="Number of threads the sparse engine uses to regrid a single file (default: 1)",
+                        )
+
+    parser.add_argument("--region", type=float, nargs=4,
+                        metavar=("LAT_MIN", "LAT_MAX", "LON_MIN", "LON_MAX"),
+                        help="Only regrid to a regional domain, given by its bounds in degrees, "
+                        "e.g. 55 72 -10 35 or -90 -60 0 360 (requires --engine sparse)",
+                        )
+
+    parser.add_argument("--precision",
+                        choices=["float64","float32","mixed"],
+                        default="float64",
+                        help="Precision of the regridding weights, accumulation and output: float64, float32, "
+                        "or mixed (float64 accumulation, output in the input precision) (default: float64)",
+                        )
+
+    parser.add_argument("--skipna", action="store_true",
+                        help="Ignore missing values when regridding, renormalising every target cell by "
+                        "its valid fraction instead of spreading missing values (False by default)")
+
+    parser.add_argument("--na-thres",
+                        type=float,
+                        default=1.0,
+                        help="With --skipna, fraction of the contributing weight of a target cell that may be "
+                        "missing before the cell is set to missing (default: 1.0, i.e. only if all are missing)",
+                        )
+
+    parser.add_argument("--output-format",
+                        choices=["netcdf","zarr"],
+                        default="netcdf",
+                        help="Write one _regridded.nc file per input file, or a single "
+                        "chunked zarr store per case and history stream (default: netcdf)",
+                        )
+
+    parser.add_argument("--readers",
+                        type=int,
+                        default=1,
+                        help="Number of threads reading input files ahead of the regridding (default: 1)",
+                        )
+
+    parser.add_argument("--writers",
+                        type=int,
+                        default=1,
+                        help="Number of threads writing regridded files (default: 1)",
+                        )
+
+    parser.add_argument("--prefetch",
+                        type=int,
+                        default=2,
+                        help="Maximum number of files waiting between the read, regrid and write stages "
+                        "(default: 2)",
+                        )
+
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and regrid history files as the model completes them (False by default)")
+
+    parser.add_argument("--poll-interval",
+                        type=float,
+                        default=30.0,
+                        help="Seconds between checks for completed history files in watch mode (default: 30)",
+                        )
+
+    parser.add_argument("--settle-time",
+                        type=float,
+                        default=60.0,
+                        help="Seconds a history file must be unmodified, with a later file of the same "
+                        "stream present, before it is regridded in watch mode (default: 60)",
+                        )
+
+    parser.add_argument("--final-settle-time",
+                        type=float,
+                        default=3600.0,
+                        help="Seconds the last file of a stream must be unmodified before it is "
+                        "regridded in watch mode (default: 3600)",
+                        )
+
+    parser.add_argument("--catalog-index", type=str,
+                        help="Path of the cached history file index (optional) "
+                        "(default: inputdir/.noresm_pyregridding_catalog.json, or the "
+                        "user cache directory if inputdir is not writable)",
+                        )
+
+    parser.add_argument("--catalog-threads",
+                        type=int,
+                        default=8,
+                        help="Number of threads used to read file headers when updating the index (default: 8)",
+                        )
+
+def check_arguments(parser, args):
+
+    """
+    Checks and converts the parsed arguments, exiting through parser on errors.
+    """
+
+    if args.region is not None:
+        if args.region[0] > args.region[1]:
+            parser.error("--region must be given as LAT_MIN LAT_MAX LON_MIN LON_MAX")
+        if args.engine != "sparse":
+            parser.error("--region requires --engine sparse")
+    if args.threads != 1 and args.engine != "sparse":
+        parser.error("--threads requires --engine sparse")
+    if args.threads < 1:
+        parser.error("--threads must be at least 1")
+    if not 0.0 <= args.na_thres <= 1.0:
+        parser.error("--na-thres must be between 0 and 1")
+    for option in ("readers", "writers", "prefetch"):
+        if getattr(args, option) < 1:
+            parser.error(f"--{option} must be at least 1")
+
+#++++++++++++++++++++++++++++++
+# Per file regridding functions
+#++++++++++++++++++++++++++++++
+
+def read_file(filepath, src_indices=None):
+
+    """
+    Reads all data of an input file into memory (pipeline read stage). For
+    regional regridding only the source columns in src_indices are read.
+    """
+
+    import xarray as xr
+
+    with xr.open_dataset(filepath) as data_in:
+        if src_indices is not None:
+            dimname = "ncol" if "ncol" in data_in.dims else "lndgrid"
+            data_in = data_in.isel({dimname: src_indices})
+        return data_in.load()
+
+def regrid_data(data_in, regridder, realm, precision, debug, skipna=False, na_thres=1.0):
+
+    """
+    Regrids the data of an input file (pipeline compute stage).
+    """
+
+    from . import noresm_pyregridding
+
+    if realm == 'atm':
+        return noresm_pyregridding.regrid_cam_se_data(
+            regridder, data_in, debug, precision=precision, skipna=skipna, na_thres=na_thres
+        )
+    elif realm == 'lnd':
+        return noresm_pyregridding.regrid_ctsm_se_data(
+            regridder, data_in, debug, precision=precision, skipna=skipna, na_thres=na_thres
+        )
+
+def run_pipeline(args, client, regridder, filelist, write, logger):
+
+    """
+    Reads, regrids and writes the files in filelist with overlapping stages.
+    """
+
+    read = functools.partial(read_file, src_indices=getattr(regridder, "src_indices", None))
+    if client is not None:
+        # send the regridder to the workers once instead of with every file
+        regridder = client.scatter(regridder, broadcast=True)
+    pipeline = RegridPipeline(
+        read,
+        regrid_data,
+        write,
+        nreaders=args.readers,
+        nwriters=args.writers,
+        queue_size=args.prefetch,
+        client=client,
+        compute_args=(
+            regridder, args.realm, args.precision, args.debug, args.skipna, args.na_thres
+        ),
+    )
+    pipeline.run(filelist)
+    logger.info(pipeline.report())
+    if args.skipna and client is None and hasattr(regridder, "mask_cache_hits"):
+        logger.info(
+            f"Missing value patterns: {regridder.mask_cache_misses} regridded, "
+            f"{regridder.mask_cache_hits} reused from the cache"
+        )
+
+def get_netcdf_output_path(filepath, outputdir):
+
+    """
+    Returns the _regridded.nc output file of an input file.
+    """
+
+    filename = os.path.basename(filepath)
+    return os.path.join(outputdir, filename.replace(".nc", "_regridded.nc"))
+
+def group_files_by_stream(catalog, filelist):
+
+    """
+    Returns a dict of the files in filelist for each history stream.
+    """
+
+    streams = {}
+    for filepath in filelist:
+        streams.setdefault(catalog.entry(filepath)["stream"], []).append(filepath)
+    return streams
+
+def find_pending_files(args, catalog, filelist, outputdir):
+
+    """
+    Returns the files in filelist that have not been regridded to outputdir
+    yet, without opening any input data.
+    """
+
+    if args.output_format == "zarr":
+        from .zarr_output import ZarrRegridWriter, get_zarr_store_name
+
+        pending = []
+        for stream, stream_files in group_files_by_stream(catalog, filelist).items():
+            store = os.path.join(outputdir, get_zarr_store_name(stream_files[0], stream))
+            pending.extend(ZarrRegridWriter(store).pending_files(stream_files))
+        return pending
+    return [
+        filepath for filepath in filelist
+        if not os.path.exists(get_netcdf_output_path(filepath, outputdir))
+    ]
+
+def regrid_files_to_netcdf(args, client, filelist, regridder, outputdir, logger):
+
+    """
+    Regrids each input file to a separate _regridded.nc file in outputdir.
+    """
+
+    # Find input files that have not already been regridded
+    pending = []
+    for filepath in filelist:
+        output_file = get_netcdf_output_path(filepath, outputdir)
+        if os.path.exists(output_file):
+            logger.info(f"Output file {output_file} already exists - skipping regridding for input {filepath}")
+            continue
+        pending.append(filepath)
+
+    def write(filepath, data_regridded):
+        # Write to a temporary file first so that interrupted writes are redone
+        output_file = get_netcdf_output_path(filepath, outputdir)
+        data_regridded.to_netcdf(f"{output_file}.tmp")
+        os.replace(f"{output_file}.tmp", output_file)
+        logger.info(f"Wrote regridded file {output_file}")
+
+    run_pipeline(args, client, regridder, pending, write, logger)
+
+def regrid_files_to_zarr(args, client, catalog, filelist, regridder, outputdir, logger):
+
+    """
+    Regrids the input files into one zarr store per case and history stream,
+    each input file filling its own slice of the time dimension.
+    """
+
+    from .zarr_output import ZarrRegridWriter, get_zarr_store_name
+
+    for stream, stream_files in group_files_by_stream(catalog, filelist).items():
+        store = os.path.join(outputdir, get_zarr_store_name(stream_files[0], stream))
+        writer = ZarrRegridWriter(store)
+        pending = writer.pending_files(stream_files)
+        if not pending:
+            logger.info(f"All files of stream {stream} already in {store} - skipping regridding")
+            continue
+
+        ntimes = [catalog.entry(filepath)["ntime"] for filepath in stream_files]
+        if writer.is_initialized:
+            # add the time slices of new files in time order before any of them is written
+            pending = sorted(pending)
+            writer.extend(pending, [catalog.entry(filepath)["ntime"] for filepath in pending])
+        layout_lock = threading.Lock()
+
+        def write(filepath, data_regridded):
+            # the store is laid out by the first result, writes to it can then run concurrently
+            with layout_lock:
+                if not writer.is_initialized:
+                    writer.initialize(data_regridded, stream_files, ntimes)
+            writer.write(data_regridded, filepath)
+            writer.mark_completed(filepath)
+            logger.info(f"Wrote regridded file {filepath} to {store}")
+
+        run_pipeline(args, client, regridder, pending, write, logger)
+        writer.finalize()
+
+def select_realm_files(args, catalog, filelist, logger):
+
+    """
+    Returns the history files in filelist on the spectral element grid of
+    args.realm, skipping e.g. ocean, sea ice and restart files and the files
+    of the other realm, which are all found in a run directory.
+    """
+
+    selected = []
+    for filepath in filelist:
+        entry = catalog.entry(filepath)
+        if entry["realm"] == args.realm and entry["stream"] is not None:
+            selected.append(filepath)
+        elif entry["stream"] is None:
+            logger.debug(f"Skipping {filepath}, it is not a history file")
+        elif entry["grid_dim"] is None:
+            logger.debug(f"Skipping {filepath}, neither ncol or lndgrid are on the input data")
+        else:
+            logger.debug(f"Skipping {filepath}, it is on the {entry['grid_dim']} grid of realm {entry['realm']}")
+    return selected
+
+def regrid_files(args, client, catalog, filelist, regridder, outputdir, logger):
+
+    """
+    Regrids the files in filelist of args.realm to the requested output format.
+    """
+
+    filelist = select_realm_files(args, catalog, filelist, logger)
+    if not filelist:
+        return
+
+    if args.output_format == "zarr":
+        regrid_files_to_zarr(args, client, catalog, filelist, regridder, outputdir, logger)
+    else:
+        regrid_files_to_netcdf(args, client, filelist, regridder, outputdir, logger)
+
+#++++++++++++++++++++++++++++++
+# Setup of dask and the regridder
+#++++++++++++++++++++++++++++++
+
+def start_dask_cluster(workers):
+
+    """
+    Starts a local dask cluster with one single threaded process per worker.
+    """
+
+    from dask.distributed import LocalCluster
+
+    ncpus_env = os.getenv("NCPUS")
+    if ncpus_env is not None:
+        ml = 1.0 - float(int(ncpus_env) - 1) / 128.0
+    else:
+        ml = "auto"  # Default memory limit if NCPUS is not set
+    cluster = LocalCluster(
+        n_workers=workers, threads_per_worker=1, memory_limit=ml
+    )
+    return cluster, cluster.get_client()
+
+def make_regridder(args):
+
+    """
+    Creates the conservative regridder of the input grid for the chosen engine.
+    """
+
+    weight_file = WEIGHT_FILES[args.inputres]
+    if args.engine == "sparse":
+        from .sparse_regridding import make_sparse_se_regridder, make_shared_sparse_se_regridder
+
+        if args.workers > 1:
+            # weights are placed once in node shared memory and attached by the workers
+            return make_shared_sparse_se_regridder(
+                weight_file, precision=args.precision, nthreads=args.threads, region=args.region
+            )
+        return make_sparse_se_regridder(
+            weight_file, precision=args.precision, nthreads=args.threads, region=args.region
+        )
+
+    from . import noresm_pyregridding
+
+    return noresm_pyregridding.make_se_regridder(
+        weight_file=weight_file, precision=args.precision
+    )
+
+#++++++++++++++++++++++++++++++
+# main regridding function
+#++++++++++++++++++++++++++++++
+
+def run(args):
+
+    """
+    Regrids all history files in args.inputdir, or keeps regridding them as
+    they are completed with args.watch.
+    """
+
+    # Determine input directory
+    inputdir = Path(args.inputdir)
+
+    # Check that inputdir exists
+    if not os.path.exists(inputdir):
+        raise ValueError(f"inputdir {inputdir} does not exist")
+
+    # Determine output directories and setup if it does not exist
+    outputdir = Path(args.outputdir)
+    if not os.path.exists(outputdir):
+        try:
+            outputdir.mkdir(parents=True, exist_ok=True)
+        except Exception as e:
+            raise ValueError(f"Could not create output directory {outputdir}, error: {e}")
+
+    # Determine list of files to regrid - headers are read in parallel and cached
+    catalog = HistoryFileCatalog(
+        inputdir, index_file=args.catalog_index, nthreads=args.catalog_threads
+    )
+    filelist = []
+    if not args.watch:
+        filelist = [
+            filepath for filepath in catalog.scan(pattern="*.nc")
+            if not filepath.endswith("_regridded.nc")
+        ]
+        filelist = select_realm_files(args, catalog, filelist, logger)
+        if len(filelist) < 1:
+            logger.error(f"No netcdf files of realm {args.realm} found in {inputdir}")
+            return
+
+        # Return before starting dask or reading the weights if there is nothing to do
+        if not find_pending_files(args, catalog, filelist, outputdir):
+            logger.info(f"All {len(filelist)} files in {inputdir} are already regridded")
+            return
+
+    # Set up dask if appropriate
+    if args.workers == 1:
+        client = None
+        cluster = None
+    else:
+        cluster, client = start_dask_cluster(args.workers)
+
+    # Create conservative regridder - want to only do this once
+    logger.info(f"Creating conservative regridder")
+    regridder = make_regridder(args)
+    logger.info(f"successfully called regridder")
+    if getattr(regridder, "src_indices", None) is not None:
+        logger.info(
+            f"Regional regridding to {regridder.shape_out} cells from "
+            f"{len(regridder.src_indices)} source columns"
+        )
+
+    try:
+        if args.watch:
+            # Keep the regridder warm and regrid history files as the model completes them
+            stop_event = threading.Event()
+            install_shutdown_handlers(stop_event)
+            watcher = HistoryFileWatcher(
+                catalog,
+                settle_time=args.settle_time,
+                final_settle_time=args.final_settle_time,
+            )
+            logger.info(f"Watching {inputdir} for completed history files, stop with Ctrl-C")
+            watch(
+                watcher,
+                lambda files: regrid_files(args, client, catalog, files, regridder, outputdir, logger),
+                poll_interval=args.poll_interval,
+                stop_event=stop_event,
+            )
+        else:
+            regrid_files(args, client, catalog, filelist, regridder, outputdir, logger)
+    finally:
+        catalog.flush()
+        if client:
+            client.close()
+        if cluster:
+            cluster.close()
+        if getattr(regridder, "shared_dir", None) is not None:
+            regridder.unlink_shared()
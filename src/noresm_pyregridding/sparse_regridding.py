@@ -0,0 +1,769 @@
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+import scipy.sparse
+import xarray as xr
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .history_catalog import get_cache_dir
+
+# Arrays making up a shared regridder, stored as .npy files that are memory mapped
+_SHARED_ARRAYS = ("data", "indices", "indptr", "lat", "lon")
+
+# Arrays that are only present for regional regridders
+_OPTIONAL_SHARED_ARRAYS = ("src_indices", "dst_mask")
+
+# Regridders attached in this process, keyed by shared directory
+_attached_regridders = {}
+
+# Number of missing value patterns whose regridded valid fraction is kept per operator
+MASK_CACHE_SIZE = 64
+
+# Bump when the layout of the cached lat/lon to SE operators changes
+LATLON_TO_SE_CACHE_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+def get_shared_memory_dir():
+    """Directory for node-level shared weights, /dev/shm when available"""
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return tempfile.gettempdir()
+
+
+def get_shared_regridder_dir(key, directory):
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return os.path.join(directory, f"noresm_pyregridding_{digest}")
+
+
+@contextlib.contextmanager
+def _lock_shared_dir(shared_dir):
+    # serialises creating, registering with and removing a shared directory
+    # between processes; the lock file is kept, as removing it would break
+    # the lock for processes waiting on it
+    with open(f"{shared_dir}.lock", "a") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _register_shared_user(shared_dir):
+    # called with the shared directory locked
+    open(os.path.join(shared_dir, f"user.{os.getpid()}"), "w").close()
+
+
+def _get_shared_users(shared_dir):
+    """Return the ids of the live processes using a shared directory"""
+    users = []
+    for name in os.listdir(shared_dir):
+        if not name.startswith("user."):
+            continue
+        pid = int(name.split(".", 1)[1])
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            # the process exited without unlinking, e.g. it was killed
+            os.remove(os.path.join(shared_dir, name))
+            continue
+        except PermissionError:
+            pass
+        users.append(pid)
+    return users
+
+
+class _ThreadedSparseOperator:
+    """
+    A CSR matrix whose products with dense fields are split into row blocks
+    of similar numbers of non-zeros and multiplied in a thread pool; scipy
+    releases the GIL in the sparse kernel, so the blocks run on several cores.
+
+    Fields with missing values can be applied with _apply_skipna, which
+    renormalises by the regridded valid fraction. The valid fraction only
+    depends on the missing value pattern, which is usually shared by many
+    fields and time steps, so it is cached by a hash of the pattern, as are
+    the source weights mapped from the valid part of a pattern (e.g. the land
+    fraction that land variables are normalised by).
+    """
+
+    def __init__(self, matrix, nthreads=1):
+        self.matrix = scipy.sparse.csr_matrix(matrix, copy=False)
+        self.nthreads = nthreads
+        self._pool = None
+        self._row_blocks = None
+        self._mask_cache = OrderedDict()
+        self._mask_lock = threading.Lock()
+        self.mask_cache_hits = 0
+        self.mask_cache_misses = 0
+
+    def _get_row_blocks(self):
+        if self._row_blocks is None:
+            # split the rows so that every block holds about the same number of weights
+            nblocks = max(1, self.nthreads)
+            nnz_bounds = np.linspace(0, self.matrix.nnz, nblocks + 1)
+            bounds = np.unique(np.searchsorted(self.matrix.indptr, nnz_bounds))
+            bounds[0] = 0
+            bounds[-1] = self.matrix.shape[0]
+            self._row_blocks = [
+                (start, stop, self._row_slice(start, stop))
+                for start, stop in zip(bounds[:-1], bounds[1:])
+                if stop > start
+            ]
+        return self._row_blocks
+
+    def _row_slice(self, start, stop):
+        # unlike matrix[start:stop], shares data and indices with the full matrix
+        indptr = self.matrix.indptr[start : stop + 1]
+        data = self.matrix.data[indptr[0] : indptr[-1]]
+        indices = self.matrix.indices[indptr[0] : indptr[-1]]
+        block = scipy.sparse.csr_matrix(
+            (data, indices, indptr - indptr[0]),
+            shape=(stop - start, self.matrix.shape[1]),
+            copy=False,
+        )
+        # scipy copies views of much larger arrays on construction, put them back
+        block.data = data
+        block.indices = indices
+        return block
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.nthreads)
+        return self._pool
+
+    def _matmul(self, fields):
+        """Return matrix @ fields for fields of shape (matrix columns, nfields)"""
+        dtype = np.result_type(self.matrix.dtype, fields.dtype)
+        out = np.empty((self.matrix.shape[0], fields.shape[1]), dtype=dtype)
+
+        if self.nthreads <= 1 or fields.shape[1] == 0:
+            out[...] = self.matrix @ fields
+        else:
+            fields = np.ascontiguousarray(fields)
+
+            def apply_block(block):
+                start, stop, matrix = block
+                out[start:stop] = matrix @ fields
+
+            list(self._get_pool().map(apply_block, self._get_row_blocks()))
+        return out
+
+    def _get_coverages(self, requests, fields=None):
+        """
+        Return matrix @ (src_weights * valid) for every (valid, src_weights)
+        in requests, where valid is a boolean (matrix columns, nfields) array
+        and src_weights an optional 1-D array over the matrix columns such as
+        the land fraction. The result of every distinct missing value pattern
+        (and src_weights) is cached, so it is only computed once. The patterns
+        that are not cached, and fields if given, are applied with a single
+        sparse multiplication, whose product with fields is returned first.
+        """
+        lookups = []
+        with self._mask_lock:
+            for valid, src_weights in requests:
+                packed = np.ascontiguousarray(np.packbits(valid, axis=0).T)
+                prefix = ""
+                if src_weights is not None:
+                    src_weights = np.asarray(src_weights, dtype=self.matrix.dtype)
+                    prefix = hashlib.sha1(src_weights.tobytes()).hexdigest()
+                keys = [prefix + hashlib.sha1(column.tobytes()).hexdigest() for column in packed]
+                first_field = {}
+                for i, key in enumerate(keys):
+                    first_field.setdefault(key, i)
+                # take the cached patterns while holding the lock, so that they cannot
+                # be evicted by the new patterns of this call or of another thread
+                coverage = {}
+                for key in first_field:
+                    if key in self._mask_cache:
+                        coverage[key] = self._mask_cache[key]
+                        self._mask_cache.move_to_end(key)
+                new_keys = [key for key in first_field if key not in coverage]
+                self.mask_cache_hits += len(keys) - len(new_keys)
+                self.mask_cache_misses += len(new_keys)
+                lookups.append((keys, first_field, coverage, new_keys))
+
+        # a single sparse apply for fields and all patterns that have not been seen before
+        columns = [] if fields is None else [fields]
+        for (valid, src_weights), (_, first_field, _, new_keys) in zip(requests, lookups):
+            if new_keys:
+                new_valid = valid[:, [first_field[key] for key in new_keys]].astype(self.matrix.dtype)
+                if src_weights is not None:
+                    new_valid *= np.asarray(src_weights, dtype=self.matrix.dtype)[:, None]
+                columns.append(new_valid)
+        regridded = self._matmul(np.concatenate(columns, axis=1)) if columns else None
+
+        results = []
+        offset = 0
+        if fields is not None:
+            results.append(regridded[:, : fields.shape[1]])
+            offset = fields.shape[1]
+        new_coverage = {}
+        for keys, first_field, coverage, new_keys in lookups:
+            for key in new_keys:
+                coverage[key] = new_coverage[key] = regridded[:, offset].copy()
+                offset += 1
+            unique = list(first_field)
+            index = {key: j for j, key in enumerate(unique)}
+            results.append(
+                np.stack([coverage[key] for key in unique], axis=1)[:, [index[key] for key in keys]]
+            )
+        if new_coverage:
+            with self._mask_lock:
+                for key, value in new_coverage.items():
+                    self._mask_cache[key] = value
+                    self._mask_cache.move_to_end(key)
+                    if len(self._mask_cache) > MASK_CACHE_SIZE:
+                        self._mask_cache.popitem(last=False)
+        return results
+
+    def _apply_skipna(self, fields, na_thres=1.0, src_weights=None):
+        """
+        Return matrix @ fields ignoring missing values, every target cell being
+        the mean over the valid part of the source cells contributing to it.
+        With src_weights the mean is weighted by them, e.g. fields multiplied
+        by the land fraction are normalised by the land fraction mapped from
+        their valid cells. Target cells where more than na_thres of the
+        contributing weight is missing are set to missing, as in xesmf.
+        """
+        valid = ~np.isnan(fields)
+        requests = [(valid, None), (np.ones((fields.shape[0], 1), dtype=bool), None)]
+        if src_weights is not None:
+            requests.append((valid, src_weights))
+        out, coverage, total, *weighted = self._get_coverages(
+            requests, fields=np.where(valid, fields, 0)
+        )
+        norm = weighted[0] if weighted else coverage
+        with np.errstate(divide="ignore", invalid="ignore"):
+            missing = 1.0 - coverage / total
+            keep = (norm > 0) & (missing <= na_thres + 1e-6)
+            return np.where(keep, out / norm, np.nan).astype(out.dtype, copy=False)
+
+
+class SparseRegridder(_ThreadedSparseOperator):
+    """
+    Applies the weights of an ESMF map file with scipy.sparse.
+
+    The regridder is called like an xesmf.Regridder on data whose horizontal
+    dimensions have been renamed to ("lat", "lon"), with a size-1 "lat", as
+    done by regrid_cam_se_data and regrid_ctsm_se_data. The rows of the weight
+    matrix are split into blocks of similar numbers of non-zeros that are
+    multiplied in a thread pool, so a single large file is regridded on
+    several cores.
+    """
+
+    def __init__(
+        self,
+        matrix,
+        lat,
+        lon,
+        nthreads=1,
+        shared_dir=None,
+        src_indices=None,
+        dst_mask=None,
+    ):
+        super().__init__(matrix, nthreads=nthreads)
+        self.lat = np.asarray(lat)
+        self.lon = np.asarray(lon)
+        if self.matrix.shape[0] != self.lat.size * self.lon.size:
+            raise ValueError(
+                f"Weight matrix has {self.matrix.shape[0]} rows, "
+                f"expected {self.lat.size} x {self.lon.size}"
+            )
+        self.shared_dir = shared_dir
+        # source columns the (regional) weights apply to, None for all columns
+        self.src_indices = src_indices
+        # target cells outside dst_mask are set to missing after regridding
+        self.dst_mask = dst_mask
+
+    def __reduce__(self):
+        # shared regridders are sent to dask workers as their directory only,
+        # and the workers attach to the memory mapped weights
+        if self.shared_dir is not None:
+            return (attach_shared_sparse_regridder, (self.shared_dir, self.nthreads))
+        return (
+            SparseRegridder,
+            (
+                self.matrix,
+                self.lat,
+                self.lon,
+                self.nthreads,
+                None,
+                self.src_indices,
+                self.dst_mask,
+            ),
+        )
+
+    def share(self, key, directory=None):
+        """
+        Place the weights in shared memory (or a memory mapped file) once per
+        node and return a regridder attached to them. key identifies the
+        weights, e.g. the weight file and precision; if another process has
+        already shared weights under the same key they are reused. The calling
+        process is registered as a user of the weights until unlink_shared().
+        """
+        if directory is None:
+            directory = get_shared_memory_dir()
+        shared_dir = get_shared_regridder_dir(key, directory)
+        with _lock_shared_dir(shared_dir):
+            if not os.path.isdir(shared_dir):
+                tmp_dir = tempfile.mkdtemp(prefix=".tmp_", dir=directory)
+                arrays = {
+                    "data": self.matrix.data,
+                    "indices": self.matrix.indices,
+                    "indptr": self.matrix.indptr,
+                    "lat": self.lat,
+                    "lon": self.lon,
+                }
+                for name in _OPTIONAL_SHARED_ARRAYS:
+                    if getattr(self, name) is not None:
+                        arrays[name] = getattr(self, name)
+                for name, array in arrays.items():
+                    np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+                np.save(os.path.join(tmp_dir, "shape.npy"), np.array(self.matrix.shape))
+                os.rename(tmp_dir, shared_dir)
+            _register_shared_user(shared_dir)
+        return attach_shared_sparse_regridder(shared_dir, self.nthreads)
+
+    def unlink_shared(self):
+        """
+        Unregister the calling process from the shared weights, and remove them
+        from the node once no other process that shared them (e.g. another job
+        on the node) is still running. Processes that are already attached keep
+        their mapping until they exit.
+        """
+        if self.shared_dir is None:
+            return
+        _attached_regridders.pop((self.shared_dir, self.nthreads), None)
+        with _lock_shared_dir(self.shared_dir):
+            if not os.path.isdir(self.shared_dir):
+                return
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.shared_dir, f"user.{os.getpid()}"))
+            users = _get_shared_users(self.shared_dir)
+            if users:
+                logger.info(
+                    f"Keeping shared weights {self.shared_dir}, still used by processes {users}"
+                )
+                return
+            shutil.rmtree(self.shared_dir, ignore_errors=True)
+
+    @property
+    def shape_out(self):
+        return (self.lat.size, self.lon.size)
+
+    @property
+    def n_in(self):
+        return self.matrix.shape[1]
+
+    def subset_region(self, lat_bounds=None, lon_bounds=None, mask=None):
+        """
+        Return a regridder for a regional target domain.
+
+        The domain is given by (min, max) latitude and longitude bounds, where
+        longitude bounds may cross the date line or the 0 meridian (e.g.
+        (-30, 40)), and/or a boolean mask on the target grid. Only the weight
+        matrix rows inside the domain are kept, and the columns are reduced to
+        the source columns that contribute to them. The returned regridder
+        expects input that has been subset to its src_indices, so only those
+        columns need to be read from the history files.
+        """
+        if self.src_indices is not None:
+            raise ValueError("Regridder is already regional")
+        in_lat = np.ones(self.lat.size, dtype=bool)
+        in_lon = np.ones(self.lon.size, dtype=bool)
+        if lat_bounds is not None:
+            in_lat = (self.lat >= lat_bounds[0]) & (self.lat <= lat_bounds[1])
+        lon_offset = np.zeros(self.lon.size)
+        # bounds spanning the full circle, e.g. (-180, 180), keep all longitudes in grid order
+        if lon_bounds is not None and lon_bounds[1] - lon_bounds[0] < 360:
+            width = (lon_bounds[1] - lon_bounds[0]) % 360
+            lon_offset = (self.lon - lon_bounds[0]) % 360
+            in_lon = lon_offset <= width
+        if mask is not None:
+            mask = np.asarray(mask, dtype=bool)
+            in_lat &= mask.any(axis=1)
+            in_lon &= mask.any(axis=0)
+
+        ilat = np.flatnonzero(in_lat)
+        # keep the longitudes in order from the western bound across any wrap point
+        ilon = np.flatnonzero(in_lon)
+        ilon = ilon[np.argsort(lon_offset[ilon], kind="stable")]
+        if ilat.size == 0 or ilon.size == 0:
+            raise ValueError("Region does not contain any target grid cells")
+
+        rows = (ilat[:, None] * self.lon.size + ilon[None, :]).ravel()
+        matrix = self.matrix[rows]
+        dst_mask = None
+        if mask is not None:
+            dst_mask = mask[np.ix_(ilat, ilon)]
+            # drop the weights of the cells outside the mask
+            matrix = scipy.sparse.diags(dst_mask.ravel().astype(matrix.dtype)) @ matrix
+            matrix.eliminate_zeros()
+        src_indices = np.unique(matrix.indices)
+        matrix = matrix[:, src_indices]
+        return SparseRegridder(
+            matrix,
+            self.lat[ilat],
+            self.lon[ilon],
+            nthreads=self.nthreads,
+            src_indices=src_indices,
+            dst_mask=dst_mask,
+        )
+
+    def apply(self, data, skipna=False, na_thres=1.0, src_weights=None):
+        """
+        Regrid a numpy array whose last dimension is the source grid, returning
+        an array with the source dimension replaced by (lat, lon). With skipna
+        missing values are ignored, and the result is normalised by the mapped
+        valid part of src_weights if given (see _apply_skipna).
+        """
+        data = np.asarray(data)
+        lead_shape = data.shape[:-1]
+        fields = data.reshape(-1, data.shape[-1]).T
+        if skipna and np.issubdtype(fields.dtype, np.floating):
+            out = self._apply_skipna(fields, na_thres=na_thres, src_weights=src_weights)
+        else:
+            out = self._matmul(fields)
+
+        # (lat*lon, fields) -> (fields..., lat, lon) without copying
+        out = np.moveaxis(out.reshape(self.shape_out + (-1,)), -1, 0)
+        out = out.reshape(lead_shape + self.shape_out)
+        if self.dst_mask is not None and np.issubdtype(out.dtype, np.floating):
+            out[..., ~self.dst_mask] = np.nan
+        return out
+
+    def regrid_dataarray(
+        self, da: xr.DataArray, skipna=False, na_thres=1.0, src_weights=None
+    ) -> xr.DataArray:
+        da = da.transpose(..., "lat", "lon")
+        data = da.values[..., 0, :]
+        regridded = self.apply(data, skipna=skipna, na_thres=na_thres, src_weights=src_weights)
+        coords = {
+            name: coord
+            for name, coord in da.coords.items()
+            if "lat" not in coord.dims and "lon" not in coord.dims
+        }
+        coords["lat"] = ("lat", self.lat)
+        coords["lon"] = ("lon", self.lon)
+        return xr.DataArray(
+            regridded, dims=da.dims, coords=coords, name=da.name, attrs=da.attrs
+        )
+
+    def __call__(self, ds_in, skipna=False, na_thres=1.0, src_weights=None):
+        """
+        Regrid a DataArray or Dataset. With skipna, src_weights optionally
+        gives the source weights to normalise by, an array for a DataArray or
+        a dict of arrays by variable name for a Dataset.
+        """
+        if isinstance(ds_in, xr.DataArray):
+            return self.regrid_dataarray(
+                ds_in, skipna=skipna, na_thres=na_thres, src_weights=src_weights
+            )
+        if ds_in.sizes.get("lat") != 1 or ds_in.sizes.get("lon") != self.n_in:
+            raise ValueError(
+                f"Expected input with lat=1 and lon={self.n_in}, got {dict(ds_in.sizes)}"
+            )
+        src_weights = src_weights or {}
+        # as xesmf, drop the variables that are not on the horizontal grid
+        regridded = {
+            name: self.regrid_dataarray(
+                da, skipna=skipna, na_thres=na_thres, src_weights=src_weights.get(name)
+            )
+            for name, da in ds_in.data_vars.items()
+            if "lat" in da.dims and "lon" in da.dims
+        }
+        ds_out = xr.Dataset(regridded, attrs=ds_in.attrs)
+        return ds_out
+
+
+def _match_coordinate(values, target, name, period=None, atol=1e-3):
+    """
+    Return the index of the value matching each target value, e.g. to reorder
+    input with descending latitudes or -180 to 180 longitudes onto a grid.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    target = np.asarray(target, dtype=np.float64)
+    if period is not None:
+        values = values % period
+        target = target % period
+    order = np.argsort(values, kind="stable")
+    pos = np.clip(np.searchsorted(values[order], target), 1, max(1, values.size - 1))
+    left = order[pos - 1]
+    right = order[np.minimum(pos, values.size - 1)]
+    index = np.where(np.abs(values[left] - target) <= np.abs(values[right] - target), left, right)
+    diff = np.abs(values[index] - target)
+    if period is not None:
+        diff = np.minimum(diff, period - diff)
+    if diff.size and diff.max() > atol:
+        raise ValueError(
+            f"{name} of the input does not match the lat/lon grid of the map file, "
+            f"regrid it to that grid first"
+        )
+    return index
+
+
+class LatLonToSERegridder(_ThreadedSparseOperator):
+    """
+    Maps fields on the regular lat/lon grid of an ESMF map file to the
+    spectral element grid, e.g. to compare observations with model output
+    on the native grid without regridding the model data.
+
+    Called on a DataArray or Dataset with ("lat", "lon") dimensions, the
+    horizontal dimensions are replaced by dimname ("ncol" or "lndgrid").
+    Missing input values are skipped, each SE cell being the mean over the
+    valid part of the lat/lon cells it overlaps. area holds the area of the
+    SE cells (in steradians) for area weighted statistics.
+    """
+
+    def __init__(self, matrix, lat, lon, area=None, nthreads=1):
+        super().__init__(matrix, nthreads=nthreads)
+        self.lat = np.asarray(lat)
+        self.lon = np.asarray(lon)
+        if self.matrix.shape[1] != self.lat.size * self.lon.size:
+            raise ValueError(
+                f"Weight matrix has {self.matrix.shape[1]} columns, "
+                f"expected {self.lat.size} x {self.lon.size}"
+            )
+        self.area = None if area is None else np.asarray(area)
+
+    @property
+    def shape_in(self):
+        return (self.lat.size, self.lon.size)
+
+    @property
+    def n_out(self):
+        return self.matrix.shape[0]
+
+    def apply(self, data, skipna=True):
+        """
+        Map a numpy array whose last two dimensions are (lat, lon) of the map
+        file grid, returning an array with them replaced by the SE grid.
+        """
+        data = np.asarray(data)
+        lead_shape = data.shape[:-2]
+        fields = data.reshape(-1, self.lat.size * self.lon.size).T
+        if skipna and np.issubdtype(fields.dtype, np.floating):
+            # renormalise by the part of each SE cell covered by valid input
+            out = self._apply_skipna(fields)
+        else:
+            out = self._matmul(fields)
+        return out.T.reshape(lead_shape + (self.n_out,))
+
+    def _align(self, da):
+        if da.sizes["lat"] != self.lat.size or da.sizes["lon"] != self.lon.size:
+            raise ValueError(
+                f"Input has lat={da.sizes['lat']} and lon={da.sizes['lon']}, the map "
+                f"file grid has lat={self.lat.size} and lon={self.lon.size}"
+            )
+        if "lat" in da.coords:
+            da = da.isel(lat=_match_coordinate(da["lat"].values, self.lat, "lat"))
+        if "lon" in da.coords:
+            da = da.isel(lon=_match_coordinate(da["lon"].values, self.lon, "lon", period=360.0))
+        return da
+
+    def regrid_dataarray(self, da: xr.DataArray, dimname="ncol", skipna=True) -> xr.DataArray:
+        da = self._align(da).transpose(..., "lat", "lon")
+        regridded = self.apply(da.values, skipna=skipna)
+        coords = {
+            name: coord
+            for name, coord in da.coords.items()
+            if "lat" not in coord.dims and "lon" not in coord.dims
+        }
+        return xr.DataArray(
+            regridded,
+            dims=da.dims[:-2] + (dimname,),
+            coords=coords,
+            name=da.name,
+            attrs=da.attrs,
+        )
+
+    def cell_areas(self, dimname="ncol"):
+        """Return the SE cell areas as a DataArray on dimname"""
+        if self.area is None:
+            raise ValueError("Cell areas are not known for this regridder")
+        return xr.DataArray(self.area, dims=(dimname,), name="area", attrs={"units": "sr"})
+
+    def __call__(self, ds_in, dimname="ncol", skipna=True):
+        if isinstance(ds_in, xr.DataArray):
+            return self.regrid_dataarray(ds_in, dimname=dimname, skipna=skipna)
+        regridded = {
+            name: self.regrid_dataarray(da, dimname=dimname, skipna=skipna)
+            for name, da in ds_in.data_vars.items()
+            if "lat" in da.dims and "lon" in da.dims
+        }
+        return xr.Dataset(regridded, attrs=ds_in.attrs)
+
+
+def make_sparse_se_regridder(weight_file, precision="float64", nthreads=1, region=None):
+    """
+    Create a SparseRegridder from an ESMF map file. Unlike make_se_regridder
+    this only reads the weights and does not need ESMF. region optionally
+    gives (lat_min, lat_max, lon_min, lon_max) of a regional target domain.
+    """
+    weights = xr.open_dataset(weight_file)
+    out_shape = weights.dst_grid_dims.load().data.tolist()[::-1]
+    n_a = weights.sizes["n_a"]
+    n_b = weights.sizes["n_b"]
+    dtype = np.float32 if precision == "float32" else np.float64
+    matrix = scipy.sparse.csr_matrix(
+        (
+            weights.S.values.astype(dtype),
+            (weights.row.values - 1, weights.col.values - 1),
+        ),
+        shape=(n_b, n_a),
+    )
+    lat = weights.yc_b.data.reshape(out_shape)[:, 0]
+    lon = weights.xc_b.data.reshape(out_shape)[0, :]
+    regridder = SparseRegridder(matrix, lat, lon, nthreads=nthreads)
+    if region is not None:
+        regridder = regridder.subset_region(region[:2], region[2:])
+    return regridder
+
+
+def attach_shared_sparse_regridder(shared_dir, nthreads=1):
+    """
+    Attach to weights placed in shared memory by SparseRegridder.share. The
+    arrays are memory mapped read-only, so every process on the node uses the
+    same physical pages, and each process only attaches once.
+    """
+    key = (shared_dir, nthreads)
+    if key not in _attached_regridders:
+        arrays = {
+            name: np.load(os.path.join(shared_dir, f"{name}.npy"), mmap_mode="r")
+            for name in _SHARED_ARRAYS
+        }
+        shape = tuple(np.load(os.path.join(shared_dir, "shape.npy")))
+        matrix = scipy.sparse.csr_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]),
+            shape=shape,
+            copy=False,
+        )
+        for name in _OPTIONAL_SHARED_ARRAYS:
+            filepath = os.path.join(shared_dir, f"{name}.npy")
+            arrays[name] = np.load(filepath, mmap_mode="r") if os.path.exists(filepath) else None
+        _attached_regridders[key] = SparseRegridder(
+            matrix,
+            arrays["lat"],
+            arrays["lon"],
+            nthreads=nthreads,
+            shared_dir=shared_dir,
+            src_indices=arrays["src_indices"],
+            dst_mask=arrays["dst_mask"],
+        )
+    return _attached_regridders[key]
+
+
+def make_shared_sparse_se_regridder(
+    weight_file, precision="float64", nthreads=1, region=None, directory=None
+):
+    """
+    Create a SparseRegridder from an ESMF map file whose weights live in node
+    shared memory. The map file is only read by the first process on the node,
+    later processes attach to the existing weights. Call unlink_shared() on
+    the returned regridder when done; the weights are removed from the node
+    when the last process that shared them does so.
+    """
+    if directory is None:
+        directory = get_shared_memory_dir()
+    stat = os.stat(weight_file)
+    key = f"{os.path.abspath(weight_file)}:{stat.st_mtime}:{stat.st_size}:{precision}:{region}"
+    shared_dir = get_shared_regridder_dir(key, directory)
+    with _lock_shared_dir(shared_dir):
+        exists = os.path.isdir(shared_dir)
+        if exists:
+            _register_shared_user(shared_dir)
+    if exists:
+        return attach_shared_sparse_regridder(shared_dir, nthreads)
+    regridder = make_sparse_se_regridder(
+        weight_file, precision=precision, nthreads=nthreads, region=region
+    )
+    return regridder.share(key, directory=directory)
+
+
+def _build_latlon_to_se_operator(weight_file):
+    weights = xr.open_dataset(weight_file)
+    n_a = weights.sizes["n_a"]
+    n_b = weights.sizes["n_b"]
+    matrix = scipy.sparse.csr_matrix(
+        (weights.S.values, (weights.row.values - 1, weights.col.values - 1)),
+        shape=(n_b, n_a),
+    )
+    if weights.dst_grid_dims.size == 1:
+        # the map already goes from lat/lon to SE, e.g. generated from grid files
+        in_shape = weights.src_grid_dims.load().data.tolist()[::-1]
+        lat = weights.yc_a.data.reshape(in_shape)[:, 0]
+        lon = weights.xc_a.data.reshape(in_shape)[0, :]
+        return matrix, lat, lon, weights.area_b.values
+
+    # overlap area of every pair of target and source cells: the weights of a
+    # conservative map are the overlaps divided by the target cell (fraction) area
+    out_shape = weights.dst_grid_dims.load().data.tolist()[::-1]
+    dst_area = weights.area_b.values
+    if weights.attrs.get("normalization") == "fracarea":
+        dst_area = dst_area * weights.frac_b.values
+    overlap = (scipy.sparse.diags(dst_area) @ matrix).T.tocsr()
+    # renormalise by the covered area of each SE cell (area_a * frac_a)
+    area = np.asarray(overlap.sum(axis=1)).ravel()
+    with np.errstate(divide="ignore"):
+        inv_area = np.where(area > 0, 1.0 / area, 0.0)
+    matrix = (scipy.sparse.diags(inv_area) @ overlap).tocsr()
+    lat = weights.yc_b.data.reshape(out_shape)[:, 0]
+    lon = weights.xc_b.data.reshape(out_shape)[0, :]
+    return matrix, lat, lon, area
+
+
+def make_latlon_to_se_regridder(weight_file, nthreads=1, cache_dir=None):
+    """
+    Create a LatLonToSERegridder from an ESMF map file. A map from SE to
+    lat/lon is transposed, with every SE cell renormalised by the area of the
+    lat/lon cells overlapping it; a map from lat/lon to SE is used as is. The
+    operator is cached in cache_dir (default: get_cache_dir()), keyed by the
+    map file and its modification time, so later calls skip reading the map.
+    """
+    if cache_dir is None:
+        cache_dir = get_cache_dir()
+    stat = os.stat(weight_file)
+    key = f"{os.path.abspath(weight_file)}:{stat.st_mtime}:{stat.st_size}:{LATLON_TO_SE_CACHE_VERSION}"
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    cache_file = os.path.join(cache_dir, f"latlon_to_se_{digest}.npz")
+
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            matrix = scipy.sparse.csr_matrix(
+                (cached["data"], cached["indices"], cached["indptr"]),
+                shape=tuple(cached["shape"]),
+            )
+            return LatLonToSERegridder(
+                matrix, cached["lat"], cached["lon"], area=cached["area"], nthreads=nthreads
+            )
+
+    matrix, lat, lon, area = _build_latlon_to_se_operator(weight_file)
+    # write atomically, silently skipping read-only cache directories
+    tmpfile = f"{cache_file}.{os.getpid()}.tmp.npz"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(
+            tmpfile,
+            data=matrix.data,
+            indices=matrix.indices,
+            indptr=matrix.indptr,
+            shape=np.array(matrix.shape),
+            lat=lat,
+            lon=lon,
+            area=area,
+        )
+        os.replace(tmpfile, cache_file)
+    except OSError as err:
+        logger.warning(f"Could not cache the lat/lon to SE operator in {cache_file}: {err}")
+    return LatLonToSERegridder(matrix, lat, lon, area=area, nthreads=nthreads)
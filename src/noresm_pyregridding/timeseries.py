@@ -0,0 +1,196 @@
+import logging
+
+from pathlib import Path
+
+from .history_catalog import HistoryFileCatalog
+
+# GenTS and dask are imported once there are files to process, so that --help
+# and runs without input files return without loading them.
+
+logger = logging.getLogger("gen_timseries")
+
+# Include patterns of the history files and time series frequency of each realm
+REALM_PATTERNS = {
+    "atmos": (["*cam.h0a*"], "mon"),
+    "land": (["*clm2.h0a*"], "mon"),
+}
+
+#++++++++++++++++++++++++++++++
+# Input arguments
+#++++++++++++++++++++++++++++++
+
+def add_arguments(parser):
+
+    """
+    Adds the command-line arguments of the time series generation to parser.
+    """
+
+    parser.add_argument('--debug', action='store_true',
+                        help="Turn on debug output (False by default).")
+
+    parser.add_argument('--inputdir', type=str,
+                        help="Comma separated full pathnames of directories containing input spectral element data files (required)",
+                        required=True
+                        )
+    parser.add_argument("--realm",
+                        choices=sorted(REALM_PATTERNS),
+                        help="Realm to process - sets include patterns for time series (required)",
+                        required=True
+                        )
+    parser.add_argument('--outputdir', type=str,
+                        help="Full path to directory where output time series data will be placed (optional) "
+                        "(default: inputdir/../time_series)",
+                        )
+    parser.add_argument("--overwrite_timeseries",
+                        action="store_true",
+                        help="Overwrite existing timeseries outputs (default: False)",
+                        )
+    parser.add_argument("--years-spec",
+                        help='colon separated specification of years to process \n'
+                        ' in format of year-first,year-last,year-increments \n '
+                        ' where year-increments specifies how many years to user for each time series file \n'
+                        ' (default: all files in inputdir are placed in one time series file)')
+    parser.add_argument("--workers",
+                        type=int,
+                        default=1,
+                        help="Number of Dask workers (default: 1, set to >1 for parallel execution)",
+                        )
+    parser.add_argument("--catalog-index", type=str,
+                        help="Path of the cached history file index (optional) "
+                        "(default: inputdir/.noresm_pyregridding_catalog.json, or the "
+                        "user cache directory if inputdir is not writable)",
+                        )
+
+#++++++++++++++++++++++++++++++
+# main time series function
+#++++++++++++++++++++++++++++++
+
+def run(args):
+
+    """
+    Creates time series from the history files in args.inputdir with GenTS.
+    """
+
+    # Determine include patterns
+    include_patterns, frequency = REALM_PATTERNS[args.realm]
+
+    # Determine input directory
+    inputdir = Path(args.inputdir)
+
+    # Determine output directories
+    if args.outputdir:
+        outputdir = Path(args.outputdir)
+    else:
+        outputdir = inputdir / '..' / 'time_series'
+
+    # Create time series by default
+    logger.info(f"Timeseries generation starting for files in {inputdir}...")
+    logger.info(f"  output will be placed in {outputdir}...")
+
+    # Determine number of files used in time series creation - the headers of
+    # new or modified files are read once and cached in the catalog index; only
+    # the files of the include patterns are scanned, not the other streams
+    catalog = HistoryFileCatalog(inputdir, index_file=args.catalog_index)
+    cnt = 0
+    for include_pattern in include_patterns:
+        cnt = cnt + len(catalog.scan(pattern=include_pattern))
+    if cnt == 0:
+        logger.warning(f"No input files to process in {inputdir} with {include_patterns}")
+        return
+
+    # Time series generation
+    from gents.hfcollection import HFCollection
+    from gents.timeseries import TSCollection
+
+    # Set up dask if appropriate
+    if args.workers == 1:
+        client = None
+        cluster = None
+    else:
+        from dask.distributed import LocalCluster
+
+        cluster = LocalCluster(
+            n_workers=args.workers, threads_per_worker=1, memory_limit="8GB",
+        )
+        client = cluster.get_client()
+
+    # Determine how time series will be created
+    if not args.years_spec:
+
+        logger.info("Starting ts_collection")
+
+        # Create base HFCollection
+        hf_collection = HFCollection(inputdir, dask_client=client)
+        hf_collection = hf_collection.include_patterns(include_patterns)
+        hf_collection.pull_metadata()
+
+        # Create base TSCollection
+        ts_collection = TSCollection(hf_collection, outputdir)
+        ts_collection = ts_collection.apply_overwrite("*")
+        ts_collection.execute()
+        logger.info("Finished ts_collection")
+
+    else:
+
+        years = args.years_spec.split(':')
+        year_first = int(years[0])
+        year_last = int(years[1])
+        nyears = int(years[2])
+        logger.info("First year to use is %s",year_first)
+        logger.info("Last year to use is %s",year_last)
+        logger.info("Year increment for time series generation is %s",nyears)
+
+        hf_collection = HFCollection(inputdir, dask_client=client)
+        for include_pattern in include_patterns:
+            logger.info("Processing files with pattern: %s", include_pattern)
+
+            # Use the catalog to skip patterns without any input files in the
+            # requested years before asking GenTS to read any metadata
+            if not catalog.files(pattern=include_pattern, years=(year_first, year_last)):
+                logger.info(f"No files to process from year {year_first} to {year_last}, skipping")
+                continue
+
+            # Reads metadata from all files matching this pattern once, the
+            # collections of the year chunks are filtered from it and keep it
+            # Gets variable names, dimensions, time information, etc.
+            hfp_all_collection = hf_collection.include_patterns([include_pattern])
+            hfp_all_collection = hfp_all_collection.include_years(year_first, year_last)
+            hfp_all_collection.pull_metadata()
+
+            for year in range(year_first, year_last+1, nyears):
+                logger.info(f"Processing from year {year} to year {year+nyears-1}")
+
+                # Use the catalog to skip chunks without any input files
+                chunk_files = catalog.files(
+                    pattern=include_pattern, years=(year, year+nyears-1)
+                )
+                if not chunk_files:
+                    logger.info(f"No files to process for year {year}, skipping")
+                    continue
+
+                hfp_collection = hfp_all_collection.include_years(year, year+nyears-1)
+
+                logger.info(f"files to process for year {year} are")
+                for item in chunk_files:
+                    logger.info(f"{item}")
+
+                # Set up the time series generation for this pattern's files
+                logger.info("Calling ts_collection")
+                ts_collection = TSCollection(
+                    hfp_collection, outputdir, ts_orders=None, dask_client=client
+                )
+                logger.info("Finished ts_collection")
+
+                # Apply overwrite if requested:
+                # If --overwrite flag was passed, tells GenTS to overwrite existing time series files
+                if args.overwrite_timeseries:
+                    ts_collection = ts_collection.apply_overwrite("*")
+
+                # Perform the time series generation for this pattern
+                ts_collection.execute()
+                logger.info("Timeseries processing complete")
+
+    if client:
+        client.close()
+    if cluster:
+        cluster.close()
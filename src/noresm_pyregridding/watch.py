@@ -0,0 +1,103 @@
+import fnmatch
+import logging
+import os
+import signal
+import threading
+import time
+
+from .history_catalog import get_history_stream
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryFileWatcher:
+    """
+    Detects history files that the model has finished writing.
+
+    The model keeps a history file open, and appends to it, until it starts
+    the next file of the same stream. A file is therefore considered complete
+    once it has not been modified for settle_time seconds and a later file of
+    its stream exists. The last file of a stream is only considered complete
+    after final_settle_time seconds without modification, e.g. at the end of
+    a run. Complete files are added to the catalog and returned once by poll().
+    """
+
+    def __init__(
+        self,
+        catalog,
+        pattern="*.nc",
+        exclude_suffix="_regridded.nc",
+        settle_time=60.0,
+        final_settle_time=3600.0,
+    ):
+        self.catalog = catalog
+        self.pattern = pattern
+        self.exclude_suffix = exclude_suffix
+        self.settle_time = settle_time
+        self.final_settle_time = final_settle_time
+        self.seen = set()
+
+    def poll(self, now=None):
+        """Return the files that have been completed since the last poll"""
+        if now is None:
+            now = time.time()
+        candidates = {}
+        last_in_stream = {}
+        with os.scandir(self.catalog.inputdir) as it:
+            for dirent in it:
+                name = dirent.name
+                if not dirent.is_file() or not fnmatch.fnmatch(name, self.pattern):
+                    continue
+                if self.exclude_suffix and name.endswith(self.exclude_suffix):
+                    continue
+                stream = get_history_stream(name) or name
+                last_in_stream[stream] = max(last_in_stream.get(stream, name), name)
+                if name not in self.seen:
+                    candidates[name] = (stream, dirent.stat().st_mtime)
+
+        ready = []
+        for name, (stream, mtime) in sorted(candidates.items()):
+            age = now - mtime
+            if age < self.settle_time:
+                continue
+            if name == last_in_stream[stream] and age < self.final_settle_time:
+                continue
+            ready.append(os.path.join(self.catalog.inputdir, name))
+
+        # files whose header cannot be read yet are retried on the next poll
+        self.catalog.update(ready)
+        ready = [filepath for filepath in ready if filepath in self.catalog]
+        self.seen.update(os.path.basename(filepath) for filepath in ready)
+        return ready
+
+
+def install_shutdown_handlers(stop_event):
+    """
+    Set stop_event on SIGINT or SIGTERM, so that a watch loop finishes the
+    files it is working on before exiting. A second signal exits immediately.
+    """
+
+    def handler(signum, frame):
+        if stop_event.is_set():
+            raise KeyboardInterrupt
+        logger.info(f"Received signal {signum}, finishing current files before exiting")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, handler)
+    signal.signal(signal.SIGTERM, handler)
+
+
+def watch(watcher, process, poll_interval=30.0, stop_event=None):
+    """
+    Call process(files) with the newly completed files every poll_interval
+    seconds until stop_event is set. A batch that has been started is always
+    finished, so output is never left half written on shutdown.
+    """
+    if stop_event is None:
+        stop_event = threading.Event()
+    while not stop_event.is_set():
+        ready = watcher.poll()
+        if ready:
+            logger.info(f"Found {len(ready)} completed history files")
+            process(ready)
+        stop_event.wait(poll_interval)
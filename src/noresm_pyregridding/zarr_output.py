@@ -0,0 +1,268 @@
+import json
+import logging
+import math
+import os
+import threading
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+# zarr, numcodecs and xarray are only imported once data is written, so that
+# checking which files are already in a store does not pay for their import
+if TYPE_CHECKING:
+    import xarray as xr
+
+logger = logging.getLogger(__name__)
+
+# Group attribute holding the time slice of the store written from each input file
+LAYOUT_ATTR = "noresm_pyregridding_layout"
+
+# Group attribute holding the input files whose data has been written to the store
+COMPLETED_ATTR = "noresm_pyregridding_completed"
+
+# Encoding keys that are carried over from the input files, everything else
+# (netcdf chunking, zlib, _FillValue, ...) is replaced by the zarr settings
+_KEPT_ENCODING = ("units", "calendar", "dtype")
+
+
+def get_zarr_store_name(filepath, stream):
+    """Name of the store for the case and history stream of an input file"""
+    filename = os.path.basename(filepath)
+    case = filename.split(f".{stream}.")[0] if stream else filename.split(".")[0]
+    return f"{case}.{stream}.zarr" if stream else f"{case}.zarr"
+
+
+def get_default_compressor(clevel=3):
+    import numcodecs
+
+    return numcodecs.Blosc(cname="zstd", clevel=clevel, shuffle=numcodecs.Blosc.SHUFFLE)
+
+
+class ZarrRegridWriter:
+    """
+    Write regridded history files into a single chunked Zarr store.
+
+    The store is allocated once for all input files of a case and history
+    stream, with every file owning a disjoint slice along the time dimension.
+    The time chunk size divides the number of time samples of every file, so
+    that writes from different input files never touch the same chunk and can
+    run concurrently from several threads or processes.
+    """
+
+    def __init__(self, store, compressor=None, consolidated=True):
+        self.store = os.fspath(store)
+        self.compressor = compressor
+        self.consolidated = consolidated
+        self.layout = {}
+        self.completed = set()
+        self._lock = threading.Lock()
+        if os.path.exists(self.store):
+            self._load_attrs()
+
+    def _load_attrs(self):
+        # the store is always written in zarr format 2, whose group attributes
+        # are a plain JSON file, so they are read without importing zarr
+        attrs_file = os.path.join(self.store, ".zattrs")
+        if not os.path.exists(attrs_file):
+            return
+        with open(attrs_file) as fh:
+            attrs = json.load(fh)
+        self.layout = {
+            name: tuple(region) for name, region in json.loads(attrs.get(LAYOUT_ATTR, "{}")).items()
+        }
+        self.completed = set(json.loads(attrs.get(COMPLETED_ATTR, "[]")))
+
+    def _open_group(self, mode="r+"):
+        """
+        Open the store to modify it. The consolidated metadata written by
+        finalize() is stale once the store is extended, and zarr-python 3
+        would otherwise take the array shapes from it.
+        """
+        import zarr
+
+        if int(zarr.__version__.split(".")[0]) >= 3:
+            return zarr.open_group(self.store, mode=mode, use_consolidated=False)
+        return zarr.open_group(self.store, mode=mode)
+
+    def _save_attrs(self):
+        group = self._open_group(mode="a")
+        group.attrs[LAYOUT_ATTR] = json.dumps(self.layout)
+        group.attrs[COMPLETED_ATTR] = json.dumps(sorted(self.completed))
+
+    @property
+    def is_initialized(self):
+        return bool(self.layout)
+
+    def pending_files(self, filepaths):
+        """Return the input files that have not been written to the store yet"""
+        return [
+            filepath
+            for filepath in filepaths
+            if os.path.basename(filepath) not in self.completed
+        ]
+
+    def initialize(self, template: "xr.Dataset", filepaths, ntimes):
+        """
+        Allocate the store from the regridded output of one input file.
+
+        filepaths and ntimes give all input files of the case and stream, in
+        time order, and their number of time samples. Variables without a time
+        dimension are written immediately, time dependent variables are only
+        allocated and filled in by write().
+        """
+        if self.is_initialized:
+            return
+        offsets = np.concatenate([[0], np.cumsum(ntimes)]).astype(int)
+        time_chunk = math.gcd(*[int(ntime) for ntime in ntimes])
+        ntime_total = int(offsets[-1])
+
+        template = self._prepare(template)
+        time_index = np.zeros(ntime_total, dtype=int)
+        time_vars = [name for name in template.data_vars if "time" in template[name].dims]
+        allocated = template.drop_vars(time_vars).isel(time=time_index)
+        for name in time_vars:
+            allocated[name] = (
+                template[name].chunk({"time": 1}).isel(time=time_index).chunk({"time": time_chunk})
+            )
+        encoding = {
+            name: self._encoding(allocated[name], time_chunk) for name in allocated.variables
+        }
+        allocated.to_zarr(
+            self.store,
+            mode="w-",
+            compute=False,
+            encoding=encoding,
+            consolidated=False,
+            zarr_format=2,
+        )
+        self.layout = {
+            os.path.basename(filepath): (int(offsets[i]), int(offsets[i + 1]))
+            for i, filepath in enumerate(filepaths)
+        }
+        with self._lock:
+            self._save_attrs()
+        logger.info(
+            f"Initialized zarr store {self.store} for {len(filepaths)} files "
+            f"with {ntime_total} time samples in chunks of {time_chunk}"
+        )
+
+    def extend(self, filepaths, ntimes):
+        """
+        Grow the time dimension of the store for input files that appeared
+        after it was initialized, e.g. while the model is still running.
+        filepaths must be in time order, and all files of a run should be
+        added with one call before any of them is written, so that their
+        time slices do not depend on the order in which writes complete.
+        """
+        filepaths = [f for f in filepaths if os.path.basename(f) not in self.layout]
+        if not filepaths:
+            return
+
+        group = self._open_group()
+        time_chunk = group["time"].chunks[0]
+        ntimes = [int(ntime) for ntime in ntimes]
+        if any(ntime % time_chunk for ntime in ntimes):
+            raise ValueError(
+                f"Cannot extend {self.store}: time chunk {time_chunk} does not divide {ntimes}"
+            )
+        ntime_total = max(stop for _, stop in self.layout.values())
+        offsets = ntime_total + np.concatenate([[0], np.cumsum(ntimes)]).astype(int)
+        for _, array in group.arrays():
+            dims = array.attrs["_ARRAY_DIMENSIONS"]
+            if "time" in dims:
+                shape = list(array.shape)
+                shape[dims.index("time")] = int(offsets[-1])
+                array.resize(tuple(shape))
+        with self._lock:
+            for i, filepath in enumerate(filepaths):
+                self.layout[os.path.basename(filepath)] = (int(offsets[i]), int(offsets[i + 1]))
+            self._save_attrs()
+        if self.consolidated and os.path.exists(os.path.join(self.store, ".zmetadata")):
+            # keep readers of the consolidated metadata in line with the new shape
+            import zarr
+
+            zarr.consolidate_metadata(self.store)
+        logger.info(f"Extended zarr store {self.store} with {len(filepaths)} files")
+
+    def _prepare(self, ds):
+        ds = ds.copy()
+        for name in ds.variables:
+            ds[name].encoding = {
+                key: value
+                for key, value in ds[name].encoding.items()
+                if key in _KEPT_ENCODING
+            }
+        return ds
+
+    def _compressor_encoding(self):
+        import zarr
+
+        compressor = self.compressor
+        if compressor is None:
+            compressor = get_default_compressor()
+        # zarr-python 3 takes a list of compressors, zarr-python 2 a single one
+        if int(zarr.__version__.split(".")[0]) >= 3:
+            return {"compressors": (compressor,)}
+        return {"compressor": compressor}
+
+    def _encoding(self, da, time_chunk):
+        encoding = dict(da.encoding)
+        if da.ndim > 0:
+            encoding["chunks"] = tuple(
+                time_chunk if dim == "time" else size for dim, size in da.sizes.items()
+            )
+        if np.issubdtype(da.dtype, np.number) and da.ndim > 0:
+            encoding.update(self._compressor_encoding())
+        return encoding
+
+    def write(self, ds: "xr.Dataset", filepath):
+        """
+        Write the regridded data of an input file to its slice of the store.
+
+        Only time dependent variables are written, so concurrent calls for
+        different input files write disjoint chunks. Call mark_completed()
+        from the coordinating process once the write has finished.
+        """
+        name = os.path.basename(filepath)
+        if name not in self.layout:
+            raise ValueError(f"{filepath} is not part of the layout of {self.store}")
+        start, stop = self.layout[name]
+        if ds.sizes.get("time") != stop - start:
+            raise ValueError(
+                f"{filepath} has {ds.sizes.get('time')} time samples, expected {stop - start}"
+            )
+        ds = self._prepare(ds)
+        ds = ds.drop_vars([v for v in ds.variables if "time" not in ds[v].dims])
+        ds.to_zarr(
+            self.store,
+            region={"time": slice(start, stop)},
+            mode="r+",
+            consolidated=False,
+            zarr_format=2,
+        )
+
+        import xarray as xr
+
+        # Index coordinates are skipped by region writes, fill in the time axis directly
+        time_array = self._open_group()["time"]
+        time = ds["time"].values
+        if not np.issubdtype(time.dtype, np.number):
+            time, _, _ = xr.coding.times.encode_cf_datetime(
+                time,
+                units=time_array.attrs.get("units"),
+                calendar=time_array.attrs.get("calendar"),
+            )
+        time_array[start:stop] = time
+
+    def mark_completed(self, filepath):
+        with self._lock:
+            self.completed.add(os.path.basename(filepath))
+            self._save_attrs()
+
+    def finalize(self):
+        """Consolidate the metadata so readers open the store with a single read"""
+        if self.consolidated and self.is_initialized:
+            import zarr
+
+            zarr.consolidate_metadata(self.store)
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+import scipy.sparse
+
+from noresm_pyregridding.sparse_regridding import SparseRegridder
+
+
+def make_sparse_regridder(nlat=4, nlon=6, ncol=50, seed=0, nthreads=1):
+    """Random row-normalised weights from ncol source columns to a nlat x nlon grid"""
+    rng = np.random.default_rng(seed)
+    matrix = scipy.sparse.random(nlat * nlon, ncol, density=0.2, format="csr", random_state=rng)
+    matrix = matrix + scipy.sparse.eye(nlat * nlon, ncol, format="csr")
+    matrix = scipy.sparse.diags(1.0 / np.asarray(matrix.sum(axis=1)).ravel()) @ matrix
+    lat = np.linspace(-60, 60, nlat)
+    lon = np.linspace(0, 300, nlon)
+    return SparseRegridder(matrix, lat, lon, nthreads=nthreads)
+
+
+@pytest.fixture
+def sparse_regridder():
+    """A small SparseRegridder with random weights"""
+    return make_sparse_regridder()
+
+
+@pytest.fixture(name="make_sparse_regridder")
+def make_sparse_regridder_fixture():
+    """Factory of SparseRegridders with random weights, see make_sparse_regridder"""
+    return make_sparse_regridder
@@ -0,0 +1,34 @@
+import pytest
+
+from noresm_pyregridding import cli
+
+REGRID_ARGS = ["regrid", "--realm", "atm", "--inputres", "ne30", "--inputdir", "in", "--outputdir", "out"]
+
+
+def parse_args(argv):
+    args = cli.build_parser().parse_args(argv)
+    args.module.check_arguments(args.subparser, args)
+    return args
+
+
+@pytest.mark.parametrize(
+    "region", [["55", "72", "-10", "35"], ["-90", "-60", "0", "360"], ["-90", "-60", "-180", "180"]]
+)
+def test_region_with_negative_bounds(region):
+    args = parse_args(REGRID_ARGS + ["--engine", "sparse", "--region"] + region)
+    assert args.region == [float(bound) for bound in region]
+
+
+@pytest.mark.parametrize(
+    "extra",
+    [
+        ["--region", "55", "72", "-10", "35"],
+        ["--engine", "sparse", "--region", "72", "55", "-10", "35"],
+        ["--writers", "0"],
+        ["--threads", "4"],
+        ["--engine", "sparse", "--threads", "0"],
+    ],
+)
+def test_invalid_regrid_arguments(extra):
+    with pytest.raises(SystemExit):
+        parse_args(REGRID_ARGS + extra)
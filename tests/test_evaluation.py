@@ -0,0 +1,36 @@
+import numpy as np
+import xarray as xr
+
+from noresm_pyregridding.evaluation import ModelObsEvaluator, read_evaluation_table
+
+LAT = np.linspace(-80, 80, 5)
+LON = np.linspace(0, 300, 6)
+
+
+def test_field_with_levels_does_not_fail_its_batch(tmp_path):
+    # PS and T share an obs file, the 3-D T must not fail the evaluation of PS
+    obs = xr.Dataset(
+        {
+            "ps": (("lat", "lon"), np.full((5, 6), 1000.0), {"units": "hPa"}),
+            "t": (("lat", "lon"), np.full((5, 6), 280.0), {"units": "K"}),
+        },
+        coords={"lat": LAT, "lon": LON},
+    )
+    obs.to_netcdf(tmp_path / "obs.nc")
+    table = tmp_path / "table.csv"
+    table.write_text("model_var,obs_file,obs_var\nPS,obs.nc,ps\nT,obs.nc,t\n")
+    model_means = xr.Dataset(
+        {
+            "PS": (("lat", "lon"), np.full((5, 6), 1001.0), {"units": "hPa"}),
+            "T": (("lev", "lat", "lon"), np.full((3, 5, 6), 281.0), {"units": "K"}),
+        },
+        coords={"lat": LAT, "lon": LON},
+    )
+
+    evaluator = ModelObsEvaluator(read_evaluation_table(table), nworkers=2)
+    rows, _ = evaluator.evaluate(model_means, case="case")
+    rows = {row["name"]: row for row in rows}
+
+    assert rows["PS"]["status"] == "ok"
+    np.testing.assert_allclose(rows["PS"]["bias"], 1.0)
+    assert rows["T"]["status"].startswith("failed")
@@ -0,0 +1,75 @@
+import json
+import os
+
+import numpy as np
+import xarray as xr
+
+from noresm_pyregridding import history_catalog
+from noresm_pyregridding.history_catalog import CATALOG_INDEX_NAME, HistoryFileCatalog
+
+
+def write_history_file(inputdir, nfile, nvars=20, ncol=8):
+    time = np.array([nfile * 31.0, nfile * 31.0 + 30.0])
+    ds = xr.Dataset(
+        {f"VAR{i}": (("time", "ncol"), np.zeros((2, ncol))) for i in range(nvars)},
+        coords={"time": ("time", time, {"units": "days since 0001-01-01", "calendar": "noleap"})},
+    )
+    filepath = inputdir / f"case.cam.h0a.0001-{nfile + 1:02d}.nc"
+    ds.to_netcdf(filepath)
+    return filepath
+
+
+def test_index_only_stores_selection_fields(tmp_path):
+    # the variable lists of long runs made the index tens of megabytes
+    for nfile in range(3):
+        write_history_file(tmp_path, nfile)
+    catalog = HistoryFileCatalog(tmp_path)
+    assert len(catalog.scan()) == 3
+
+    with open(tmp_path / CATALOG_INDEX_NAME) as fh:
+        index = json.load(fh)
+    entry = index["files"]["case.cam.h0a.0001-01.nc"]
+    assert "variables" not in entry
+    assert entry["realm"] == "atm"
+    assert entry["stream"] == "cam.h0a"
+    assert entry["ntime"] == 2
+    assert os.path.getsize(tmp_path / CATALOG_INDEX_NAME) < 3 * 400
+
+    # a second catalog reads the index instead of the files
+    assert HistoryFileCatalog(tmp_path).entries == catalog.entries
+
+
+def test_index_falls_back_to_cache_dir(tmp_path, monkeypatch):
+    inputdir = tmp_path / "input"
+    inputdir.mkdir()
+    write_history_file(inputdir, 0)
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    # chmod does not stop root from writing, so pretend the directory is read-only
+    access = os.access
+    monkeypatch.setattr(
+        history_catalog.os,
+        "access",
+        lambda path, mode: False if os.fspath(path) == str(inputdir) else access(path, mode),
+    )
+
+    catalog = HistoryFileCatalog(inputdir)
+    catalog.scan()
+    assert os.path.dirname(catalog.index_file) == str(tmp_path / "cache" / "noresm_pyregridding" / "catalogs")
+    assert os.path.exists(catalog.index_file)
+    assert not (inputdir / CATALOG_INDEX_NAME).exists()
+    assert HistoryFileCatalog(inputdir).entries == catalog.entries
+
+
+def test_update_defers_saving(tmp_path):
+    # watch mode updates the catalog for every batch, which should not rewrite the index
+    catalog = HistoryFileCatalog(tmp_path, save_interval=3600.0)
+    catalog.update([write_history_file(tmp_path, 0)])
+    catalog.update([write_history_file(tmp_path, 1)])
+    assert not (tmp_path / CATALOG_INDEX_NAME).exists()
+
+    catalog.flush()
+    assert len(HistoryFileCatalog(tmp_path).entries) == 2
+
+    catalog.save_interval = 0.0
+    catalog.update([write_history_file(tmp_path, 2)])
+    assert len(HistoryFileCatalog(tmp_path).entries) == 3
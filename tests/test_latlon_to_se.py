@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from noresm_pyregridding import sparse_regridding
+from noresm_pyregridding.sparse_regridding import make_latlon_to_se_regridder
+
+NLAT, NLON, NCOL = 6, 12, 40
+REFINE = 4
+
+
+def write_se_to_latlon_map(path, normalization="fracarea", uncovered=0.0, seed=0):
+    """
+    Write a conservative ESMF map from NCOL SE cells to a NLAT x NLON grid.
+    The sphere is cut into REFINE x REFINE pieces per lat/lon cell, each SE
+    cell is a random set of pieces, and a fraction uncovered of the pieces
+    belongs to no SE cell, so that some lat/lon cells are partly covered.
+    """
+    rng = np.random.default_rng(seed)
+    lat_edges = np.linspace(-90, 90, NLAT * REFINE + 1)
+    piece_area = np.outer(
+        np.diff(np.sin(np.deg2rad(lat_edges))), np.full(NLON * REFINE, 2 * np.pi / (NLON * REFINE))
+    )
+    ilat, ilon = np.meshgrid(np.arange(NLAT * REFINE), np.arange(NLON * REFINE), indexing="ij")
+    dst = ((ilat // REFINE) * NLON + ilon // REFINE).ravel()
+    src = rng.integers(0, NCOL, dst.size)
+    src[rng.random(dst.size) < uncovered] = -1
+    src[:NCOL] = np.arange(NCOL)
+    piece_area = piece_area.ravel()
+
+    covered = src >= 0
+    overlap = np.zeros((NLAT * NLON, NCOL))
+    np.add.at(overlap, (dst[covered], src[covered]), piece_area[covered])
+    area_b = np.bincount(dst, piece_area, NLAT * NLON)
+    area_a = overlap.sum(axis=0)
+    frac_b = overlap.sum(axis=1) / area_b
+    norm = area_b * frac_b if normalization == "fracarea" else area_b
+    row, col = np.nonzero(overlap)
+
+    lat = 0.5 * (lat_edges[:-1:REFINE] + lat_edges[REFINE::REFINE])
+    lon = (np.arange(NLON) + 0.5) * 360.0 / NLON
+    yc, xc = np.meshgrid(lat, lon, indexing="ij")
+    xr.Dataset(
+        {
+            "S": ("n_s", overlap[row, col] / norm[row]),
+            "row": ("n_s", row + 1),
+            "col": ("n_s", col + 1),
+            "area_a": ("n_a", area_a),
+            "frac_a": ("n_a", np.ones(NCOL)),
+            "area_b": ("n_b", area_b),
+            "frac_b": ("n_b", frac_b),
+            "yc_b": ("n_b", yc.ravel()),
+            "xc_b": ("n_b", xc.ravel()),
+            "src_grid_dims": ("src_grid_rank", np.array([NCOL])),
+            "dst_grid_dims": ("dst_grid_rank", np.array([NLON, NLAT])),
+        },
+        attrs={"normalization": normalization},
+    ).to_netcdf(path)
+    return area_a, frac_b * area_b
+
+
+@pytest.mark.parametrize("normalization,uncovered", [("destarea", 0.0), ("fracarea", 0.2)])
+def test_transposed_map_is_conservative(tmp_path, normalization, uncovered):
+    area_a, covered_b = write_se_to_latlon_map(tmp_path / "map.nc", normalization, uncovered)
+    regridder = make_latlon_to_se_regridder(tmp_path / "map.nc", cache_dir=tmp_path / "cache")
+    np.testing.assert_allclose(regridder.area, area_a)
+
+    # a constant stays constant on every SE cell
+    np.testing.assert_allclose(regridder.apply(np.full((NLAT, NLON), 3.0)), 3.0)
+
+    # the integral over the covered part of the lat/lon grid is conserved
+    field = np.random.default_rng(1).normal(size=(2, NLAT, NLON))
+    mapped = regridder.apply(field)
+    np.testing.assert_allclose(
+        mapped @ regridder.area, field.reshape(2, -1) @ covered_b, rtol=1e-12
+    )
+
+
+def test_operator_cache_round_trip(tmp_path, monkeypatch):
+    write_se_to_latlon_map(tmp_path / "map.nc")
+    built = make_latlon_to_se_regridder(tmp_path / "map.nc", cache_dir=tmp_path / "cache")
+    assert len(list((tmp_path / "cache").glob("latlon_to_se_*.npz"))) == 1
+
+    def fail(weight_file):
+        raise AssertionError("the map file should not be read again")
+
+    monkeypatch.setattr(sparse_regridding, "_build_latlon_to_se_operator", fail)
+    cached = make_latlon_to_se_regridder(tmp_path / "map.nc", cache_dir=tmp_path / "cache")
+    assert (cached.matrix != built.matrix).nnz == 0
+    np.testing.assert_array_equal(cached.lat, built.lat)
+    np.testing.assert_array_equal(cached.lon, built.lon)
+    np.testing.assert_array_equal(cached.area, built.area)
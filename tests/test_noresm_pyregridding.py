@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from noresm_pyregridding.noresm_pyregridding import regrid_ctsm_se_data
+
+
+def make_land_dataset(ncol, seed=0):
+    rng = np.random.default_rng(seed)
+    landmask = (rng.random(ncol) < 0.6).astype(np.int32)
+    landfrac = np.where(landmask == 1, rng.uniform(0.2, 1.0, ncol), 0.0)
+    return xr.Dataset(
+        {
+            "landfrac": ("lndgrid", landfrac),
+            "landmask": ("lndgrid", landmask),
+            "nbedrock": ("lndgrid", rng.integers(1, 10, ncol).astype(np.int32)),
+            "TSOI": (("time", "lndgrid"), rng.normal(280, 5, (2, ncol)).astype(np.float32)),
+        }
+    )
+
+
+@pytest.mark.parametrize("precision", ["float64", "float32", "mixed"])
+def test_integer_land_fields_stay_fractional(sparse_regridder, precision):
+    # regridded integer fields are fractions, mixed mode must not cast them
+    # back to the integer input dtype
+    ds_in = make_land_dataset(sparse_regridder.n_in)
+    reference = regrid_ctsm_se_data(sparse_regridder, ds_in, False, precision="float64")
+    ds_out = regrid_ctsm_se_data(sparse_regridder, ds_in, False, precision=precision)
+
+    for var in ("landmask", "nbedrock"):
+        assert np.issubdtype(ds_out[var].dtype, np.floating)
+        np.testing.assert_allclose(ds_out[var].values, reference[var].values, rtol=1e-6)
+    assert 0 < float(ds_out["landmask"].max()) <= 1
+    expected = np.float64 if precision == "float64" else np.float32
+    assert ds_out["TSOI"].dtype == expected
+
+
+def test_skipna_land_normalisation_reuses_patterns(sparse_regridder):
+    # land variables sharing the ocean mask, each with one more missing cell,
+    # are normalised by the land fraction mapped from their valid cells with
+    # no more sparse multiplications than regridding without skipna
+    rng = np.random.default_rng(1)
+    ncol = sparse_regridder.n_in
+    landfrac = np.where(rng.random(ncol) < 0.6, rng.uniform(0.2, 1.0, ncol), np.nan)
+    data_vars = {"landfrac": ("lndgrid", landfrac)}
+    for i in range(10):
+        field = rng.normal(size=(12, ncol))
+        field[:, np.isnan(landfrac)] = np.nan
+        field[rng.integers(12), rng.integers(ncol)] = np.nan
+        data_vars[f"VAR{i}"] = (("time", "lndgrid"), field)
+    ds_in = xr.Dataset(data_vars)
+
+    calls = []
+    matmul = sparse_regridder._matmul
+    sparse_regridder._matmul = lambda fields: calls.append(fields.shape[1]) or matmul(fields)
+    regrid_ctsm_se_data(sparse_regridder, ds_in, False)
+    ncalls = len(calls)
+    calls.clear()
+    ds_out = regrid_ctsm_se_data(sparse_regridder, ds_in, False, skipna=True)
+    assert len(calls) == ncalls
+
+    matrix = sparse_regridder.matrix.toarray()
+    weights = np.nan_to_num(landfrac)
+    for i in range(10):
+        field = ds_in[f"VAR{i}"].values
+        valid = ~np.isnan(field)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            expected = (matrix @ np.where(valid, field * weights, 0).T) / (matrix @ (valid * weights).T)
+        np.testing.assert_allclose(
+            ds_out[f"VAR{i}"].values, expected.T.reshape(ds_out[f"VAR{i}"].shape), rtol=1e-12
+        )
@@ -0,0 +1,86 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from noresm_pyregridding import sparse_regridding
+
+
+def reference_skipna(regridder, data):
+    """Dense renormalised regridding of every field of data separately"""
+    matrix = regridder.matrix.toarray()
+    out = []
+    for field in data:
+        valid = ~np.isnan(field)
+        coverage = matrix @ valid
+        with np.errstate(divide="ignore", invalid="ignore"):
+            out.append(np.where(coverage > 0, matrix @ np.where(valid, field, 0) / coverage, np.nan))
+    return np.array(out).reshape((len(data),) + regridder.shape_out)
+
+
+def test_skipna_more_new_patterns_than_cache_size(sparse_regridder):
+    # a call with more new missing value patterns than the cache holds must
+    # not evict the patterns it found in the cache before reading them
+    rng = np.random.default_rng(1)
+    first = rng.normal(size=(1, sparse_regridder.n_in))
+    first[0, :5] = np.nan
+    sparse_regridder.apply(first, skipna=True)
+
+    nfields = sparse_regridding.MASK_CACHE_SIZE + 40
+    data = rng.normal(size=(nfields, sparse_regridder.n_in))
+    data[rng.random(data.shape) < 0.2] = np.nan
+    data[-1] = first[0]
+    out = sparse_regridder.apply(data, skipna=True)
+
+    np.testing.assert_allclose(out, reference_skipna(sparse_regridder, data))
+    assert sparse_regridder.mask_cache_hits >= 1
+    assert len(sparse_regridder._mask_cache) <= sparse_regridding.MASK_CACHE_SIZE
+
+
+def test_subset_region_full_circle_longitudes(sparse_regridder):
+    # an Arctic cap written as -180,180 or 0,360 keeps every longitude
+    for lon_bounds in ((-180, 180), (0, 360)):
+        regional = sparse_regridder.subset_region((0, 90), lon_bounds)
+        np.testing.assert_array_equal(regional.lon, sparse_regridder.lon)
+        np.testing.assert_array_equal(regional.lat, sparse_regridder.lat[sparse_regridder.lat >= 0])
+
+
+def test_subset_region_across_date_line(sparse_regridder):
+    regional = sparse_regridder.subset_region((-90, 90), (-100, 100))
+    np.testing.assert_array_equal(regional.lon, [300, 0, 60])
+
+
+def test_shared_weights_kept_while_other_jobs_use_them(sparse_regridder, tmp_path):
+    # another job on the node shared the same weights, unlinking from this
+    # job must leave them for the workers of the other job
+    shared = sparse_regridder.share("weights", directory=tmp_path)
+    other_job = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    try:
+        open(os.path.join(shared.shared_dir, f"user.{other_job.pid}"), "w").close()
+        shared.unlink_shared()
+        assert os.path.isdir(shared.shared_dir)
+        attached = sparse_regridding.attach_shared_sparse_regridder(shared.shared_dir)
+        np.testing.assert_array_equal(attached.matrix.toarray(), sparse_regridder.matrix.toarray())
+    finally:
+        other_job.kill()
+        other_job.wait()
+
+    # the other job exited without unlinking, the last user removes the weights
+    shared = sparse_regridder.share("weights", directory=tmp_path)
+    shared.unlink_shared()
+    assert not os.path.exists(shared.shared_dir)
+
+
+@pytest.mark.parametrize("nthreads", [2, 3, 8])
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_threaded_matmul_matches_single_thread(make_sparse_regridder, nthreads, dtype):
+    single = make_sparse_regridder(nlat=12, nlon=20, ncol=300)
+    threaded = make_sparse_regridder(nlat=12, nlon=20, ncol=300, nthreads=nthreads)
+    fields = np.random.default_rng(2).normal(size=(300, 7)).astype(dtype)
+
+    expected = single._matmul(fields)
+    np.testing.assert_array_equal(threaded._matmul(fields), expected)
+    np.testing.assert_array_equal(threaded._matmul(fields[:, :1]), expected[:, :1])
+    assert len(threaded._get_row_blocks()) > 1
@@ -0,0 +1,85 @@
+import logging
+import types
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from noresm_pyregridding.history_catalog import HistoryFileCatalog
+from noresm_pyregridding.regrid_folder import regrid_files
+from noresm_pyregridding.watch import HistoryFileWatcher
+
+pytest.importorskip("zarr")
+
+
+def write_history_file(inputdir, nfile, ncol, steps_per_file=2, stream="cam.h1", dimname="ncol"):
+    time = np.arange(steps_per_file, dtype=np.float64) + nfile * steps_per_file
+    ds = xr.Dataset(
+        {"TS": (("time", dimname), np.repeat(time[:, None], ncol, axis=1))},
+        coords={
+            "time": (
+                "time",
+                time,
+                {"units": "days since 0001-01-01 00:00:00", "calendar": "noleap"},
+            )
+        },
+    )
+    ds.to_netcdf(inputdir / f"case.{stream}.0001-01-{nfile + 1:02d}-00000.nc")
+
+
+def make_args(output_format="zarr"):
+    return types.SimpleNamespace(
+        output_format=output_format, readers=2, writers=2, prefetch=2, realm="atm",
+        precision="float64", debug=False, skipna=False, na_thres=1.0,
+    )
+
+
+def test_watch_batches_to_zarr(sparse_regridder, tmp_path):
+    # every poll batch after the first extends the store, the time axis and
+    # the data of all batches must end up in time order
+    inputdir = tmp_path / "input"
+    outputdir = tmp_path / "output"
+    inputdir.mkdir()
+    outputdir.mkdir()
+    args = make_args()
+    catalog = HistoryFileCatalog(inputdir)
+    watcher = HistoryFileWatcher(catalog, settle_time=0.0, final_settle_time=0.0)
+    logger = logging.getLogger("noresm_pyregridding")
+
+    for batch in ([0, 1], [2, 3, 4]):
+        for nfile in batch:
+            write_history_file(inputdir, nfile, sparse_regridder.n_in)
+        ready = watcher.poll()
+        assert len(ready) == len(batch)
+        regrid_files(args, None, catalog, ready, sparse_regridder, outputdir, logger)
+
+    with xr.open_zarr(outputdir / "case.cam.h1.zarr", decode_times=False) as ds:
+        np.testing.assert_array_equal(ds["time"].values, np.arange(10.0))
+        np.testing.assert_allclose(ds["TS"].values[:, 0, 0], np.arange(10.0))
+
+
+def test_watch_skips_other_components(sparse_regridder, tmp_path):
+    # a run directory also holds land, ocean and restart files, only the
+    # history files of the requested realm are regridded
+    inputdir = tmp_path / "input"
+    outputdir = tmp_path / "output"
+    inputdir.mkdir()
+    outputdir.mkdir()
+    ncol = sparse_regridder.n_in
+    for nfile in range(2):
+        write_history_file(inputdir, nfile, ncol)
+        write_history_file(inputdir, nfile, ncol, stream="clm2.h0", dimname="lndgrid")
+        write_history_file(inputdir, nfile, 7, stream="blom.hm", dimname="x")
+    xr.Dataset({"T": ("ncol", np.zeros(ncol))}).to_netcdf(inputdir / "case.cam.r.0001-01-02-00000.nc")
+    catalog = HistoryFileCatalog(inputdir)
+    watcher = HistoryFileWatcher(catalog, settle_time=0.0, final_settle_time=0.0)
+
+    ready = watcher.poll()
+    assert len(ready) == 7
+    regrid_files(
+        make_args("netcdf"), None, catalog, ready, sparse_regridder, outputdir,
+        logging.getLogger("noresm_pyregridding"),
+    )
+    assert sorted(path.name for path in outputdir.iterdir()) == [
+        f"case.cam.h1.0001-01-{nfile:02d}-00000_regridded.nc" for nfile in (1, 2)
+    ]
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from noresm_pyregridding.zarr_output import ZarrRegridWriter
+
+pytest.importorskip("zarr")
+
+
+def make_regridded(i):
+    time = xr.DataArray([i + 0.5], dims="time", attrs={"units": "days since 2000-01-01"})
+    return xr.Dataset(
+        {"T": (("time", "lat", "lon"), np.full((1, 2, 3), float(i)))},
+        coords={"time": time, "lat": [0.0, 1.0], "lon": [0.0, 1.0, 2.0]},
+    )
+
+
+def test_extend_consolidated_store(tmp_path):
+    # files added to a finalized store get their time values, whatever the
+    # order in which their writes complete
+    store = tmp_path / "case.h0a.zarr"
+    files = [f"case.cam.h0a.000{i}-01.nc" for i in range(4)]
+    writer = ZarrRegridWriter(store)
+    writer.initialize(make_regridded(0), files[:2], [1, 1])
+    for i in range(2):
+        writer.write(make_regridded(i), files[i])
+        writer.mark_completed(files[i])
+    writer.finalize()
+
+    writer = ZarrRegridWriter(store)
+    writer.extend(files[2:], [1, 1])
+    for i in (3, 2):
+        writer.write(make_regridded(i), files[i])
+        writer.mark_completed(files[i])
+    writer.finalize()
+
+    with xr.open_zarr(store, decode_times=False) as ds:
+        np.testing.assert_array_equal(ds["time"].values, [0.5, 1.5, 2.5, 3.5])
+        np.testing.assert_array_equal(ds["T"].values[:, 0, 0], [0.0, 1.0, 2.0, 3.0])